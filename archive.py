@@ -0,0 +1,86 @@
+"""
+    Moves delivered orders out of the live ``orders`` table into ``orders_archive``.
+
+    Operations only work on active orders, so archiving old delivered ones keeps
+    ``orders`` and its indexes small enough to stay in memory. Lookups by id and
+    by user fall back to the archive (see order_routes.py).
+
+        python init_db.py archive --older-than-days 30
+
+    or set ORDER_ARCHIVE_INTERVAL to run it in the background of the app.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, literal, select
+from database import get_sessionmaker
+from models import Order, OrderArchive
+
+logger = logging.getLogger("pizza.archive")
+
+ORDER_ARCHIVE_AFTER_DAYS = float(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "30"))
+ORDER_ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", "1000"))
+# Seconds between background runs in the app; 0 leaves archiving to the CLI
+ORDER_ARCHIVE_INTERVAL = float(os.getenv("ORDER_ARCHIVE_INTERVAL", "0"))
+
+ARCHIVED_STATUS = "DELIVERED"
+
+
+async def archive_batch(db, cutoff, batch_size):
+    """
+        Move up to ``batch_size`` delivered orders last changed before ``cutoff``
+        and return how many were moved. The caller commits. Rows locked by a
+        concurrent writer are skipped and picked up by a later run.
+    """
+    ids = (await db.execute(
+        select(Order.id)
+        .where(Order.order_status == ARCHIVED_STATUS, Order.updated_at < cutoff)
+        .order_by(Order.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+    if not ids:
+        return 0
+
+    columns = ["id", "quantity", "order_status", "pizza_size", "user_id", "version", "updated_at", "archived_at"]
+    await db.execute(insert(OrderArchive).from_select(columns, select(
+        Order.id, Order.quantity, Order.order_status, Order.pizza_size, Order.user_id, Order.version,
+        Order.updated_at, literal(datetime.utcnow()),
+    ).where(Order.id.in_(ids))))
+    await db.execute(delete(Order).where(Order.id.in_(ids)).execution_options(synchronize_session=False))
+    return len(ids)
+
+
+async def archive_orders(older_than_days=None, batch_size=None, pause=0.05):
+    """
+        Archive every delivered order older than ``older_than_days``, one short
+        transaction per batch so writers and replicas are never held up for
+        long. Returns the number of orders moved.
+    """
+    older_than_days = ORDER_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or ORDER_ARCHIVE_BATCH_SIZE
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    total = 0
+    while True:
+        async with get_sessionmaker()() as db:
+            moved = await archive_batch(db, cutoff, batch_size)
+            await db.commit()
+        total += moved
+        if moved < batch_size:
+            return total
+        await asyncio.sleep(pause)
+
+
+async def run_archiver(interval=None):
+    """Background task for the app lifespan: archive every ``interval`` seconds until cancelled."""
+    interval = interval or ORDER_ARCHIVE_INTERVAL
+    while True:
+        try:
+            moved = await archive_orders()
+            if moved:
+                logger.info("Archived %d delivered orders", moved)
+        except Exception:
+            logger.exception("Order archiving failed")
+        await asyncio.sleep(interval)
@@ -1,12 +1,18 @@
 from os import access
+from typing import Optional
 from fastapi import APIRouter,status
 from fastapi.exceptions import HTTPException
-from database import SessionLocal, engine
-from schemas import SignUpModel, LoginModel
+from database import get_db
+from security import load_user, token_claims, user_cache, CurrentUser, get_current_user, jwt_required, jwt_refresh_required
+from revocation import revocations
+from schemas import SignUpModel, LoginModel, LogoutModel, UserResponse
 from models import User
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
-from werkzeug.security import generate_password_hash, check_password_hash
+from hashing import password_hasher
+from query_budget import query_budget
+from ratelimit import rate_limit
 from fastapi_jwt_auth import AuthJWT
 from fastapi.encoders import jsonable_encoder
 
@@ -15,37 +21,19 @@ auth_router=APIRouter(
     tags=['auth']
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-
-session=SessionLocal(bind=engine)
-@auth_router.get('/')
-async def hello(Authorize:AuthJWT=Depends()):
+@auth_router.get('/', dependencies=[Depends(jwt_required)])
+async def hello():
     """
         ## Sample hello world route
     
     """
-    try:
-        Authorize.jwt_required()
-
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Invalid Token"
-        )
-
     return {"message" : "Hello World"}
 
 
 
 # Example usage in the route
-@auth_router.post('/signup', response_model=SignUpModel, status_code=status.HTTP_201_CREATED)
-async def signup(user: SignUpModel, db: Session = Depends(get_db)):
+@auth_router.post('/signup', response_model=UserResponse, status_code=status.HTTP_201_CREATED, dependencies=[Depends(rate_limit("signup")), Depends(query_budget(3))])
+async def signup(user: SignUpModel, db: AsyncSession = Depends(get_db)):
     """
         ## Create a user
         This requires the following
@@ -59,13 +47,13 @@ async def signup(user: SignUpModel, db: Session = Depends(get_db)):
         ```
     
     """
-    db_email = db.query(User).filter(User.email == user.email).first()
+    db_email = (await db.execute(select(User.id).filter(User.email == user.email))).first()
 
     if db_email:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="User with the email already exists")
 
-    db_username = db.query(User).filter(User.username == user.username).first()
+    db_username = (await db.execute(select(User.id).filter(User.username == user.username))).first()
 
     if db_username:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
@@ -74,21 +62,20 @@ async def signup(user: SignUpModel, db: Session = Depends(get_db)):
     new_user = User(
         username=user.username,
         email=user.email,
-        password=generate_password_hash(user.password),
+        password=await password_hasher.hash(user.password),
         is_staff=user.is_staff,
         is_active=user.is_active
     )
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)  # Refresh to get the new user's ID if needed
+    await db.commit()  # the new id is set on flush and kept, since sessions don't expire on commit
 
-    return jsonable_encoder(new_user)
+    return new_user
 
 #login route
 
-@auth_router.post('/login', status_code=200)
-async def login(user: LoginModel, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
+@auth_router.post('/login', status_code=200, dependencies=[Depends(rate_limit("login")), Depends(query_budget(2))])
+async def login(user: LoginModel, Authorize: AuthJWT = Depends(), db: AsyncSession = Depends(get_db)):
     """     
         ## Login a user
         This requires
@@ -98,10 +85,17 @@ async def login(user: LoginModel, Authorize: AuthJWT = Depends(), db: Session =
             ```
         and returns a token pair `access` and `refresh`
     """
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user and check_password_hash(db_user.password, user.password): # type: ignore
-        access_token = Authorize.create_access_token(subject=db_user.username) # type: ignore
-        refresh_token = Authorize.create_refresh_token(subject=db_user.username) # type: ignore
+    db_user = (await db.execute(select(User).filter(User.username == user.username))).scalars().first()
+    valid, new_hash = await password_hasher.verify_and_update(db_user.password, user.password) if db_user else (False, None)
+    if valid:
+        if new_hash:
+            # Stored hash uses outdated parameters, upgrade it transparently
+            db_user.password = new_hash # type: ignore
+            await db.commit()
+        claims = token_claims(db_user)
+        access_token = Authorize.create_access_token(subject=db_user.username, user_claims=claims) # type: ignore
+        refresh_token = Authorize.create_refresh_token(subject=db_user.username, user_claims=claims) # type: ignore
+        user_cache.set(CurrentUser(id=db_user.id, username=db_user.username, is_staff=bool(db_user.is_staff))) # type: ignore
 
         response = {
             "access": access_token,
@@ -115,24 +109,62 @@ async def login(user: LoginModel, Authorize: AuthJWT = Depends(), db: Session =
 
 #refreshing tokens
 
-@auth_router.get('/refresh')
-async def refresh_token(Authorize:AuthJWT=Depends()):
+@auth_router.get('/refresh', dependencies=[Depends(rate_limit("refresh")), Depends(query_budget(1))])
+async def refresh_token(Authorize:AuthJWT=Depends(jwt_refresh_required), db: AsyncSession = Depends(get_db)):
     """
     ## Create a fresh token
     This creates a fresh token. It requires an refresh token.
     """
-    try:
-        Authorize.jwt_refresh_token_required()
-    except Exception as e:
+    # Look the user up (usually a cache hit) so role changes reach the new token
+    current_user=await load_user(db, Authorize.get_jwt_subject())
+    if current_user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Please provide a valid refresh token"
         )
-    
-    current_user=Authorize.get_jwt_subject()
 
-    access_token=Authorize.create_access_token(subject=current_user) # type: ignore
+    access_token=Authorize.create_access_token(subject=current_user.username, user_claims=token_claims(current_user)) # type: ignore
 
     return jsonable_encoder({"access":access_token})
 
+#logging out and revoking tokens
 
+@auth_router.post('/logout', status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(query_budget(1))])
+async def logout(body: Optional[LogoutModel] = None, Authorize: AuthJWT = Depends(jwt_required), db: AsyncSession = Depends(get_db)):
+    """
+        ## Log out
+        This revokes the access token sent with the request. Send the
+        refresh token as `refresh` to revoke it as well.
+    """
+    tokens=[Authorize.get_raw_jwt()]
+    if body is not None and body.refresh:
+        try:
+            refresh=Authorize.get_raw_jwt(body.refresh)
+        except Exception:
+            refresh=None
+        if refresh is None or refresh.get("type")!="refresh" or refresh.get("sub")!=tokens[0].get("sub"):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid refresh token"
+            )
+        tokens.append(refresh)
+
+    await revocations.revoke_tokens(db, tokens)
+
+@auth_router.post('/users/{id}/revoke-tokens', status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(query_budget(2))])
+async def revoke_user_tokens(id:int, current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+        ## Revoke all of a user's tokens
+        This signs a user out everywhere: every access and refresh token issued
+        to them so far stops working. It can be accessed by superusers.
+    """
+    if not current_user.is_staff:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You are not a superuser"
+        )
+
+    username=(await db.execute(select(User.username).filter(User.id==id))).scalar()
+    if username is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+            detail="No user with such id"
+        )
 
+    await revocations.revoke_subject(db, username)
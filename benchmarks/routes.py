@@ -0,0 +1,264 @@
+"""
+    Load and latency benchmark for the API routes.
+
+    Seeds a database with users and orders, drives the ASGI app in-process and
+    reports p50/p95/p99 latency, requests/sec and DB queries per request for each
+    scenario. Results are written as JSON so runs can be compared:
+
+        python benchmarks/routes.py --users 200 --orders 20000 --output before.json
+        python benchmarks/routes.py --users 200 --orders 20000 --output after.json --compare before.json
+
+    By default a temporary SQLite file is used; pass --database-url to point at a
+    MySQL-compatible server instead (its tables are created if missing).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+PASSWORD = "benchmark-password"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class QueryCounter:
+    """Counts statements sent to the database through the engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+async def seed(users, orders, pwhash):
+    from sqlalchemy import insert
+    from database import get_sessionmaker
+    from models import User, Order
+
+    rng = random.Random(42)
+    sizes = [size for size, _ in Order.PIZZA_SIZES]
+    statuses = [status for status, _ in Order.ORDER_STATUSES]
+    async with get_sessionmaker()() as db:
+        await db.execute(insert(User), [
+            {"username": "staff", "email": "staff@example.com", "password": pwhash, "is_staff": True, "is_active": True}
+        ] + [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": pwhash, "is_staff": False, "is_active": True}
+            for i in range(users)
+        ])
+        for start in range(0, orders, 1000):
+            await db.execute(insert(Order), [
+                {
+                    "quantity": rng.randint(1, 5),
+                    "pizza_size": rng.choice(sizes),
+                    "order_status": rng.choice(statuses),
+                    "user_id": rng.randint(2, users + 1),
+                }
+                for _ in range(start, min(start + 1000, orders))
+            ])
+        await db.commit()
+
+
+class Context:
+    def __init__(self, users, orders):
+        self.users = users
+        self.orders = orders
+        self.rng = random.Random(7)
+        self.headers = {}
+        self.placed = []
+        self.signups = 0
+
+    def user_headers(self):
+        return self.headers[f"user{self.rng.randrange(self.users)}"]
+
+
+async def login(client, username):
+    r = await client.post("/auth/login", json={"username": username, "password": PASSWORD})
+    r.raise_for_status()
+    return {"Authorization": "Bearer " + r.json()["access"]}
+
+
+# Each scenario issues one request and returns the response
+async def signup(client, ctx):
+    ctx.signups += 1
+    n = ctx.signups
+    return await client.post("/auth/signup", json={
+        "username": f"new{n}", "email": f"new{n}@example.com", "password": PASSWORD,
+    })
+
+
+async def login_scenario(client, ctx):
+    return await client.post("/auth/login", json={
+        "username": f"user{ctx.rng.randrange(ctx.users)}", "password": PASSWORD,
+    })
+
+
+async def place_order(client, ctx):
+    r = await client.post("/order/order", json={"quantity": 2, "pizza_size": "LARGE"},
+                          headers=ctx.headers["user0"])
+    if r.status_code == 201:
+        ctx.placed.append(r.json()["id"])
+    return r
+
+
+async def list_all_orders(client, ctx):
+    return await client.get("/order/order", params={"limit": 50}, headers=ctx.headers["staff"])
+
+
+async def list_user_orders(client, ctx):
+    return await client.get("/order/user/orders", headers=ctx.user_headers())
+
+
+async def get_order_by_id(client, ctx):
+    return await client.get(f"/order/orders/{ctx.rng.randint(1, ctx.orders)}", headers=ctx.headers["staff"])
+
+
+async def update_status(client, ctx):
+    return await client.patch(f"/order/order/update/{ctx.rng.randint(1, ctx.orders)}",
+                              json={"order_status": "IN-TRANSIT"}, headers=ctx.headers["staff"])
+
+
+async def delete_order(client, ctx):
+    order_id = ctx.placed.pop() if ctx.placed else ctx.rng.randint(1, ctx.orders)
+    return await client.delete(f"/order/order/delete/{order_id}", headers=ctx.headers["user0"])
+
+
+SCENARIOS = {
+    "signup": signup,
+    "login": login_scenario,
+    "place_order": place_order,
+    "list_all_orders": list_all_orders,
+    "list_user_orders": list_user_orders,
+    "get_order_by_id": get_order_by_id,
+    "update_status": update_status,
+    "delete_order": delete_order,
+}
+
+
+async def run_scenario(client, ctx, scenario, requests, concurrency, counter):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            r = await scenario(client, ctx)
+            latencies.append(time.perf_counter() - start)
+            if r.status_code >= 400:
+                errors += 1
+
+    queries_before = counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rps": requests / elapsed,
+        "queries_per_request": (counter.count - queries_before) / requests,
+    }
+
+
+async def benchmark(args):
+    import httpx
+    import main
+    from database import get_engine
+    from init_db import create
+    from hashing import password_hasher
+
+    await create()
+    counter = QueryCounter(get_engine())
+    await seed(args.users, args.orders, await password_hasher.hash(PASSWORD))
+
+    ctx = Context(args.users, args.orders)
+    results = {}
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for username in ["staff"] + [f"user{i}" for i in range(args.users)]:
+                ctx.headers[username] = await login(client, username)
+
+            for name in args.scenarios:
+                requests = args.auth_requests if name in ("signup", "login") else args.requests
+                results[name] = await run_scenario(client, ctx, SCENARIOS[name], requests, args.concurrency, counter)
+                print_result(name, results[name])
+
+    return results
+
+
+def print_result(name, r, baseline=None):
+    line = (f"{name:>18}: p50 {r['p50_ms']:7.2f} ms  p95 {r['p95_ms']:7.2f} ms  p99 {r['p99_ms']:7.2f} ms"
+            f"  {r['rps']:8.1f} req/s  {r['queries_per_request']:5.2f} queries/req")
+    if r["errors"]:
+        line += f"  ({r['errors']} errors)"
+    if baseline:
+        line += f"  [p95 {r['p95_ms'] / baseline['p95_ms'] - 1:+.0%}, req/s {r['rps'] / baseline['rps'] - 1:+.0%}]"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--auth-requests", type=int, default=50, help="requests for signup and login, which hash passwords")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="keep the rate and concurrency limits on (by default they are off, since every "
+                             "request comes from one client and the numbers would measure the limiter)")
+    args = parser.parse_args()
+
+    tmpdir = None
+    if not args.database_url:
+        tmpdir = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite+aiosqlite:///{tmpdir.name}/bench.db"
+    # database.py and ratelimit.py read their settings at import time
+    os.environ["DATABASE_URL"] = args.database_url
+    if not args.rate_limits:
+        os.environ["RATE_LIMIT_BACKEND"] = "none"
+        os.environ["MAX_CONCURRENT_REQUESTS"] = "0"
+
+    results = asyncio.run(benchmark(args))
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["scenarios"]
+        print(f"\nCompared with {args.compare}:")
+        for name, r in results.items():
+            print_result(name, r, baseline.get(name))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "python": platform.python_version(),
+            "scenarios": results,
+        }, indent=2))
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+    Serialization cost of large order lists, before and after typed responses.
+
+    "before" is the old path: load full ``Order`` entities, walk them with
+    ``jsonable_encoder`` and render with the standard library ``json``.
+    "model" selects only ``crud.ORDER_COLUMNS`` but lets FastAPI validate and
+    encode the rows through the ``OrderPage`` response model.
+    "after" is what the list routes do: select ``crud.ORDER_COLUMNS`` and render
+    the rows with ``pagination.page_response`` (orjson).
+
+        python benchmarks/serialization.py --sizes 100 1000 10000 --repeat 20
+
+    Load and serialize times are reported separately (median per list), using
+    an in-memory SQLite database.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+async def seed(orders):
+    from sqlalchemy import insert
+    from database import create_tables, get_sessionmaker
+    from models import Order, User
+
+    await create_tables()
+    sizes = [size for size, _ in Order.PIZZA_SIZES]
+    async with get_sessionmaker()() as db:
+        await db.execute(insert(User), [{"username": "bench", "email": "bench@example.com", "is_staff": False, "is_active": True}])
+        for start in range(0, orders, 1000):
+            await db.execute(insert(Order), [
+                {"quantity": i % 5 + 1, "pizza_size": sizes[i % len(sizes)], "order_status": "PENDING", "user_id": 1}
+                for i in range(start, min(start + 1000, orders))
+            ])
+        await db.commit()
+
+
+async def before(db, size):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from sqlalchemy import select
+    from models import Order
+
+    start = time.perf_counter()
+    orders = (await db.execute(select(Order).order_by(Order.id).limit(size))).scalars().all()
+    loaded = time.perf_counter()
+    body = JSONResponse(jsonable_encoder({"items": orders, "next_cursor": None})).body
+    return loaded - start, time.perf_counter() - loaded, len(body)
+
+
+async def model(db, size, field):
+    from fastapi.routing import serialize_response
+    from sqlalchemy import select
+    from crud import ORDER_COLUMNS
+    from metrics import TimedJSONResponse
+    from models import Order
+
+    start = time.perf_counter()
+    orders = (await db.execute(select(*ORDER_COLUMNS).order_by(Order.id).limit(size))).all()
+    loaded = time.perf_counter()
+    content = await serialize_response(field=field, response_content={"items": orders, "next_cursor": None},
+                                       is_coroutine=True)
+    body = TimedJSONResponse(content).body
+    return loaded - start, time.perf_counter() - loaded, len(body)
+
+
+async def after(db, size):
+    from sqlalchemy import select
+    from crud import ORDER_COLUMNS
+    from models import Order
+    from pagination import page_content, page_response
+
+    start = time.perf_counter()
+    orders = (await db.execute(select(*ORDER_COLUMNS).order_by(Order.id).limit(size))).all()
+    loaded = time.perf_counter()
+    body = page_response(page_content(orders, None)).body
+    return loaded - start, time.perf_counter() - loaded, len(body)
+
+
+async def benchmark(args):
+    from fastapi.utils import create_response_field
+    from database import dispose_engine, get_sessionmaker
+    from schemas import OrderPage
+
+    await seed(max(args.sizes))
+    field = create_response_field(name="response", type_=OrderPage)
+    print(f"{'orders':>8}  {'path':<6}  {'load ms':>9}  {'serialize ms':>12}  {'bytes':>9}")
+    async with get_sessionmaker()() as db:
+        for size in args.sizes:
+            results = {}
+            paths = (
+                ("before", lambda: before(db, size)),
+                ("model", lambda: model(db, size, field)),
+                ("after", lambda: after(db, size)),
+            )
+            for name, run in paths:
+                await run()  # warm up
+                samples = [await run() for _ in range(args.repeat)]
+                load = statistics.median(s[0] for s in samples) * 1000
+                serialize = statistics.median(s[1] for s in samples) * 1000
+                results[name] = serialize
+                print(f"{size:>8}  {name:<6}  {load:>9.2f}  {serialize:>12.2f}  {samples[0][2]:>9}")
+            print(f"{'':>8}  serialization {results['before'] / results['after']:.1f}x faster\n")
+    await dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="orders per list")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    # database.py reads its settings at import time
+    os.environ["DATABASE_URL"] = "sqlite+aiosqlite://"
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+    Cold-start benchmark: how long a fresh worker takes to import the app and
+    serve its first request. Each run is a new interpreter, like a uvicorn worker.
+
+        python benchmarks/startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Runs inside the child interpreter and prints its timings as JSON
+CHILD = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    started = time.perf_counter()
+    client.get("/")
+    served = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "lifespan": started - imported,
+    "first_request": served - started,
+    "total": served - start,
+}))
+"""
+
+
+def run_once(env):
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env,
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///:memory:",
+                        help="DSN for the workers; the app must start without reaching it")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=args.database_url)
+    runs = [run_once(env) for _ in range(args.runs)]
+    results = {
+        "runs": args.runs,
+        "phases": {phase: summarize([r[phase] for r in runs]) for phase in runs[0]},
+    }
+
+    for phase, stats in results["phases"].items():
+        print(f"{phase:>14}: median {stats['median'] * 1000:8.1f} ms"
+              f"  (min {stats['min'] * 1000:.1f}, max {stats['max'] * 1000:.1f})")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("pizza.cache")
+
+
+class MemoryBackend:
+    """In-process TTL + LRU cache. Entries are dropped when they expire or when the cache is full."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """
+        Cache stored in Redis, shared by every worker. Redis expires and evicts
+        keys itself, so evictions aren't counted here.
+    """
+
+    evictions = 0
+
+    def __init__(self, client, prefix="pizza:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key):
+        raw = await self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key, value, ttl):
+        await self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    async def delete(self, *keys):
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    def size(self):
+        return None
+
+    @classmethod
+    def from_url(cls, url):
+        import redis.asyncio as redis
+        return cls(redis.from_url(url))
+
+
+class OrderCache:
+    """
+        Read-through cache for order reads, keyed by order id and by user id.
+        A user's list pages live under a single key so one delete drops them all.
+        Writers must call ``invalidate`` after committing. The in-process memory
+        backend is only invalidated in the worker that made the write, so it is
+        for single-worker deployments; use Redis with more. With a read replica,
+        ``reinvalidate_after`` repeats the delete once the replica has caught up,
+        dropping anything a lagging replica read put back in the meantime.
+    """
+
+    max_pages_per_user = 16
+
+    def __init__(self, backend, ttl=30.0, reinvalidate_after=0.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.reinvalidate_after = reinvalidate_after
+        self.hits = 0
+        self.misses = 0
+        self._pending = set()
+
+    @staticmethod
+    def order_key(order_id):
+        return f"order:{order_id}"
+
+    @staticmethod
+    def user_orders_key(user_id):
+        return f"user_orders:{user_id}"
+
+    async def _get(self, key):
+        if self.backend is None:
+            return None
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def get_order(self, order_id):
+        return await self._get(self.order_key(order_id))
+
+    async def set_order(self, order_id, payload):
+        if self.backend is not None:
+            await self.backend.set(self.order_key(order_id), payload, self.ttl)
+
+    async def get_user_orders(self, user_id, page_key):
+        if self.backend is None:
+            return None
+        pages = await self.backend.get(self.user_orders_key(user_id))
+        payload = pages.get(page_key) if pages else None
+        if payload is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return payload
+
+    async def set_user_orders(self, user_id, page_key, payload):
+        if self.backend is None:
+            return
+        key = self.user_orders_key(user_id)
+        pages = await self.backend.get(key) or {}
+        if len(pages) >= self.max_pages_per_user:
+            pages = {}
+        pages[page_key] = payload
+        await self.backend.set(key, pages, self.ttl)
+
+    async def invalidate(self, order_ids=(), user_ids=()):
+        """
+            Drop cached entries after a committed write. A backend failure is
+            logged rather than failing the request, whose write already happened;
+            the entries then expire after ``ttl``.
+        """
+        if self.backend is not None:
+            keys = [self.order_key(i) for i in set(order_ids)]
+            keys += [self.user_orders_key(i) for i in set(user_ids) if i is not None]
+            await self._delete(keys)
+            if self.reinvalidate_after:
+                task = asyncio.get_running_loop().create_task(self._delete_later(keys))
+                self._pending.add(task)
+                task.add_done_callback(self._pending.discard)
+
+    async def _delete(self, keys):
+        try:
+            await self.backend.delete(*keys)
+        except Exception:
+            logger.exception("Could not invalidate %d order cache entries", len(keys))
+
+    async def _delete_later(self, keys):
+        await asyncio.sleep(self.reinvalidate_after)
+        await self._delete(keys)
+
+    def stats(self):
+        backend = self.backend
+        return {
+            "backend": type(backend).__name__ if backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": backend.evictions if backend is not None else 0,
+            "size": backend.size() if backend is not None else 0,
+        }
+
+
+def _make_backend(name):
+    if name == "memory":
+        return MemoryBackend(maxsize=int(os.getenv("ORDER_CACHE_SIZE", "10000")))
+    if name == "redis":
+        return RedisBackend.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return None
+
+
+order_cache = OrderCache(
+    _make_backend(os.getenv("ORDER_CACHE_BACKEND", "none")),
+    ttl=float(os.getenv("ORDER_CACHE_TTL", "30")),
+)
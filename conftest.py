@@ -0,0 +1,72 @@
+import os
+
+# Settings are read at import time: run the app on an in-memory database, with
+# strict query budgets as in CI, cheap password hashes and no request limits
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("QUERY_BUDGET_STRICT", "1")
+os.environ.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+os.environ.setdefault("ORDER_CACHE_BACKEND", "none")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+os.environ.setdefault("MAX_CONCURRENT_REQUESTS", "0")
+
+import pytest
+from fastapi.testclient import TestClient
+from query_budget import assert_max_queries
+
+
+@pytest.fixture
+def client():
+    """A client for the app, which starts on a fresh, empty database."""
+    from database import get_engine
+    from main import app
+    from models import Base
+
+    async def create_tables():
+        async with get_engine().begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    # The engine is created by the app lifespan and disposed when it ends
+    with TestClient(app) as client:
+        client.portal.call(create_tables)
+        yield client
+
+
+def _login(client, username, is_staff):
+    client.post("/auth/signup", json={
+        "username": username, "email": f"{username}@example.com", "password": "password", "is_staff": is_staff,
+    })
+    tokens = client.post("/auth/login", json={"username": username, "password": "password"}).json()
+    return {"Authorization": "Bearer " + tokens["access"]}
+
+
+@pytest.fixture
+def staff_headers(client):
+    return _login(client, "staff", is_staff=True)
+
+
+@pytest.fixture
+def user_headers(client):
+    return _login(client, "customer", is_staff=False)
+
+
+@pytest.fixture
+def max_queries():
+    """
+        Fail a test when a block runs more SQL statements than allowed:
+
+            def test_list_orders(client, staff_headers, max_queries):
+                with max_queries(1):
+                    client.get("/order/order", headers=staff_headers)
+    """
+    return assert_max_queries
+
+
+@pytest.fixture
+def redis_workers():
+    """``redis_workers(n)``: clients of ``n`` workers sharing one fake Redis server (skips without fakeredis)."""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    def workers(count):
+        server = fakeredis.FakeServer()
+        return [fakeredis.FakeAsyncRedis(server=server) for _ in range(count)]
+    return workers
@@ -0,0 +1,218 @@
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, or_, select, update
+from models import Order, OrderArchive, OrderChange
+
+PIZZA_SIZES = dict(Order.PIZZA_SIZES)
+ORDER_STATUSES = dict(Order.ORDER_STATUSES)
+
+def order_columns(model):
+    """The columns order responses are built from (schemas.OrderResponse), of ``Order`` or ``OrderArchive``."""
+    return (model.id, model.quantity, model.order_status, model.pizza_size, model.user_id, model.version)
+
+
+ORDER_COLUMNS = order_columns(Order)
+ARCHIVE_COLUMNS = order_columns(OrderArchive)
+
+# Seconds a missing change id is re-checked by the changes feed, in case the
+# write holding it commits late; a write slower than this was rolled back
+ORDER_CHANGES_GAP_SECONDS = float(os.getenv("ORDER_CHANGES_GAP_SECONDS", "60"))
+MAX_CHANGE_GAPS = 100
+
+UpdatedOrder = namedtuple("UpdatedOrder", "id user_id version")
+
+
+def order_errors(order):
+    """Return why an order can't be placed, or ``None`` if it is valid."""
+    try:
+        quantity = int(order.quantity)
+    except (TypeError, ValueError):
+        return "quantity must be an integer"
+    if quantity < 1:
+        return "quantity must be at least 1"
+    if order.pizza_size not in PIZZA_SIZES:
+        return f"pizza_size must be one of {', '.join(PIZZA_SIZES)}"
+    return None
+
+
+async def insert_orders(db, rows):
+    """
+        Insert order rows with a single multi-row INSERT and return the new ids,
+        in the same order as ``rows``. The caller owns the transaction.
+    """
+    if not rows:
+        return []
+
+    dialect = db.bind.dialect
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        # SQLite, PostgreSQL, MariaDB: batched INSERT ... RETURNING id
+        result = await db.execute(insert(Order).returning(Order.id, sort_by_parameter_order=True), rows)
+        return list(result.scalars())
+
+    # MySQL has no RETURNING. A multi-row INSERT is a "simple insert", so InnoDB
+    # hands it a consecutive block of ids and LAST_INSERT_ID() is the first one.
+    result = await db.execute(insert(Order).values(rows))
+    first_id = result.lastrowid
+    return list(range(first_id, first_id + len(rows)))
+
+
+async def update_orders_status(db, order_status, conditions):
+    """
+        Move every order matching ``conditions`` to ``order_status`` with one
+        set-based UPDATE, without loading ORM objects. Returns the affected
+        ``UpdatedOrder(id, user_id, version)`` rows ordered by id, with their new
+        version. The caller owns the transaction.
+    """
+    values = {"order_status": order_status, "version": Order.version + 1}
+    dialect = db.bind.dialect
+    if dialect.update_returning:
+        result = await db.execute(
+            update(Order).where(*conditions).values(**values)
+            .returning(Order.id, Order.user_id, Order.version)
+            .execution_options(synchronize_session=False)
+        )
+        return sorted((UpdatedOrder(*row) for row in result), key=lambda row: row.id)
+
+    # MySQL has no UPDATE ... RETURNING: lock the matching ids, then update them
+    rows = (await db.execute(
+        select(Order.id, Order.user_id, Order.version).where(*conditions).order_by(Order.id).with_for_update()
+    )).all()
+    if rows:
+        await db.execute(
+            update(Order).where(Order.id.in_([row.id for row in rows])).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    return [UpdatedOrder(row.id, row.user_id, row.version + 1) for row in rows]
+
+
+async def update_order(db, order_id, values, expected_version=None):
+    """
+        Apply ``values`` to one order with a set-based UPDATE that also bumps its
+        version, and return the order's ``ORDER_COLUMNS`` afterwards as a dict.
+        With ``expected_version`` only that version is updated. Returns ``None``
+        when no order matched. The caller owns the transaction.
+    """
+    conditions = [Order.id == order_id]
+    if expected_version is not None:
+        conditions.append(Order.version == expected_version)
+    statement = (
+        update(Order).where(*conditions).values(**values, version=Order.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if db.bind.dialect.update_returning:
+        row = (await db.execute(statement.returning(*ORDER_COLUMNS))).first()
+    else:
+        # MySQL has no UPDATE ... RETURNING: read the row back, still locked by the update
+        if (await db.execute(statement)).rowcount == 0:
+            return None
+        row = (await db.execute(select(*ORDER_COLUMNS).where(Order.id == order_id))).first()
+    return row._asdict() if row is not None else None
+
+
+async def delete_order(db, order_id, expected_version=None):
+    """
+        Delete one order, only at ``expected_version`` when given, and return the
+        ``(user_id, version)`` it had, or ``None`` when no order matched. The
+        caller owns the transaction.
+    """
+    conditions = [Order.id == order_id]
+    if expected_version is not None:
+        conditions.append(Order.version == expected_version)
+    if db.bind.dialect.delete_returning:
+        return (await db.execute(
+            delete(Order).where(*conditions).returning(Order.user_id, Order.version)
+            .execution_options(synchronize_session=False)
+        )).first()
+
+    row = (await db.execute(select(Order.user_id, Order.version).where(*conditions).with_for_update())).first()
+    if row is not None:
+        await db.execute(delete(Order).where(Order.id == order_id).execution_options(synchronize_session=False))
+    return row
+
+
+async def record_order_changes(db, changes, deleted=False):
+    """
+        Append ``(order_id, user_id, version)`` changes to the order change log
+        with one INSERT. Call it in the same transaction as the writes it records.
+    """
+    now = datetime.utcnow()
+    rows = [
+        {"order_id": order_id, "user_id": user_id, "version": version, "deleted": deleted, "changed_at": now}
+        for order_id, user_id, version in changes
+    ]
+    if rows:
+        await db.execute(insert(OrderChange), rows)
+
+
+async def order_changes(db, since, limit, gaps=()):
+    """
+        Read up to ``limit`` log entries after the change id ``since``, plus any
+        that filled the ``(first, last, seen_at)`` id ranges earlier reads found
+        missing, joined with the current state of their order, live or archived
+        (``None`` columns once deleted). Returns the rows and whether more
+        entries are waiting.
+    """
+    # An order is either live or archived, never both
+    current = (func.coalesce(live, archived).label(live.key) for live, archived in zip(ORDER_COLUMNS, ARCHIVE_COLUMNS))
+    stmt = (
+        select(OrderChange.id.label("change_id"), OrderChange.order_id, OrderChange.version.label("change_version"),
+               OrderChange.changed_at, *current)
+        .outerjoin(Order, Order.id == OrderChange.order_id)
+        .outerjoin(OrderArchive, OrderArchive.id == OrderChange.order_id)
+        .where(or_(OrderChange.id > since, *(OrderChange.id.between(first, last) for first, last, _ in gaps)))
+        .order_by(OrderChange.id)
+        .limit(limit + 1)
+    )
+    rows = (await db.execute(stmt)).all()
+    return rows[:limit], len(rows) > limit
+
+
+def change_log_gaps(since, gaps, rows, now=None):
+    """
+        Where the changes feed continues after returning ``rows``: the last id
+        read and the id ranges still missing up to it. Ids are allocated before
+        commit, so a write can become visible after a higher id already has;
+        recent gaps are re-checked for ORDER_CHANGES_GAP_SECONDS instead of
+        being skipped for good.
+    """
+    now = int(time.time() if now is None else now)
+    ids = [row.change_id for row in rows]
+
+    remaining = []
+    for first, last, seen_at in gaps:
+        if seen_at < now - ORDER_CHANGES_GAP_SECONDS:
+            continue
+        for change_id in ids:
+            if change_id > last:
+                break
+            if change_id >= first:
+                if change_id > first:
+                    remaining.append((first, change_id - 1, seen_at))
+                first = change_id + 1
+        if first <= last:
+            remaining.append((first, last, seen_at))
+
+    # Older holes are rolled-back writes, not ones still committing
+    recent = datetime.utcnow() - timedelta(seconds=ORDER_CHANGES_GAP_SECONDS)
+    last_id = since
+    for row in rows:
+        if row.change_id <= since:
+            continue
+        if row.change_id > last_id + 1 and row.changed_at >= recent:
+            remaining.append((last_id + 1, row.change_id - 1, now))
+        last_id = row.change_id
+    return last_id, remaining[-MAX_CHANGE_GAPS:]
+
+
+async def user_orders_version(db, user_id):
+    """
+        Id of the latest change to any of the user's orders (``None`` if there
+        is none). It moves whenever one of their orders is placed, changed or
+        deleted, so it tags their order lists; ``ix_order_changes_user_id_id``
+        answers it from the index.
+    """
+    return (await db.execute(
+        select(func.max(OrderChange.id)).where(OrderChange.user_id == user_id)
+    )).scalar()
@@ -0,0 +1,67 @@
+"""
+    ETags and conditional requests: GETs with ``If-None-Match`` (``304 Not
+    Modified``) and order writes with ``If-Match`` (``412 Precondition Failed``).
+
+    Orders are tagged by their row version and order lists by the user's latest
+    entry in the order change log, so both can be checked before loading or
+    rendering anything. Other responses are tagged by a hash of their body.
+"""
+import hashlib
+from fastapi import status
+from fastapi.exceptions import HTTPException
+
+
+def order_etag(order_id, version):
+    return f'"order-{order_id}-v{version}"'
+
+
+def list_etag(*parts):
+    """Tag for a list response identified by ``parts`` (a version plus everything that selects the page)."""
+    return '"' + hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest()[:27] + '"'
+
+
+def body_etag(body):
+    return '"' + hashlib.sha1(body).hexdigest()[:27] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an ``If-None-Match`` header value covers ``etag`` (weak comparison, as RFC 9110 asks)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def check_not_modified(if_none_match, etag):
+    """Answer with an empty 304 if the client already has ``etag``."""
+    if etag_matches(if_none_match, etag):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+def tag_by_body(response, if_none_match):
+    """Tag a rendered response by a hash of its body, or answer 304 if the client has it already."""
+    etag = body_etag(response.body)
+    check_not_modified(if_none_match, etag)
+    response.headers["ETag"] = etag
+    return response
+
+
+def if_match_version(if_match, order_id):
+    """
+        The order version an ``If-Match`` header asks a write to apply to, or
+        ``None`` without one (or with ``*``). A header that names no version of
+        this order can never match, so it fails with 412 straight away.
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    prefix = f'"order-{order_id}-v'
+    for tag in (tag.strip() for tag in if_match.split(",")):
+        # If-Match uses the strong comparison, so weak tags never match
+        version = tag[len(prefix):-1] if tag.startswith(prefix) and tag.endswith('"') else ""
+        if version.isdigit():
+            return int(version)
+    raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="If-Match does not name a version of this order"
+    )
@@ -0,0 +1,192 @@
+"""
+    Server-push order status updates.
+
+    Writers publish to a per-user channel after committing; the
+    ``/order/user/orders/events`` route streams a user's channel as Server-Sent
+    Events, so clients no longer need to poll their orders for status changes.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("pizza.events")
+
+# Seconds between keep-alive comments on an idle event stream
+ORDER_EVENTS_KEEPALIVE = float(os.getenv("ORDER_EVENTS_KEEPALIVE", "15"))
+
+
+class Subscription:
+    """A subscriber's bounded queue. When it's full the oldest message is dropped."""
+
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class MemoryBroker:
+    """In-process fan-out. Only reaches subscribers connected to the same worker."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+
+    async def publish(self, channel, message):
+        for subscription in self._subscribers.get(channel, ()):
+            subscription.put(message)
+
+    async def publish_many(self, messages):
+        for channel, message in messages:
+            await self.publish(channel, message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        subscription = Subscription(self.queue_size)
+        self._subscribers[channel].add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscribers = self._subscribers[channel]
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def subscriber_count(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    async def close(self):
+        pass
+
+
+class RedisBroker:
+    """
+        Fan-out across workers through Redis pub/sub. Each worker holds a single
+        pattern subscription and hands messages to its local subscribers.
+    """
+
+    def __init__(self, client, prefix="pizza:events:", queue_size=100):
+        self.client = client
+        self.prefix = prefix
+        self.local = MemoryBroker(queue_size)
+        self._listener = None
+
+    async def publish(self, channel, message):
+        await self.client.publish(self.prefix + channel, json.dumps(message))
+
+    async def publish_many(self, messages):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for channel, message in messages:
+                pipe.publish(self.prefix + channel, json.dumps(message))
+            await pipe.execute()
+
+    def subscribe(self, channel):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return self.local.subscribe(channel)
+
+    async def _listen(self):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.psubscribe(self.prefix + "*")
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    await self.local.publish(channel[len(self.prefix):], json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Order event listener failed, reconnecting")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def subscriber_count(self):
+        return self.local.subscriber_count()
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis.asyncio as redis
+        return cls(redis.from_url(url), **kwargs)
+
+
+class OrderEvents:
+    """Status changes of a user's orders, published on the channel ``user_orders:{user_id}``."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    @staticmethod
+    def channel(user_id):
+        return f"user_orders:{user_id}"
+
+    async def publish_status(self, orders):
+        """
+            Publish ``(id, user_id, order_status)`` changes after they were committed.
+            A broker failure is logged rather than failing the request that made the change.
+        """
+        messages = [
+            (self.channel(user_id), {"id": order_id, "order_status": order_status})
+            for order_id, user_id, order_status in orders if user_id is not None
+        ]
+        if not messages:
+            return
+        try:
+            await self.broker.publish_many(messages)
+        except Exception:
+            logger.exception("Could not publish %d order status events", len(messages))
+
+    def subscribe(self, user_id):
+        return self.broker.subscribe(self.channel(user_id))
+
+    async def stream(self, user_id, keepalive=None):
+        """
+            Yield a user's status changes as Server-Sent Events, with a comment
+            line every ``keepalive`` seconds so idle proxies keep the connection open.
+        """
+        keepalive = ORDER_EVENTS_KEEPALIVE if keepalive is None else keepalive
+        async with self.subscribe(user_id) as subscription:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: order_status\ndata: {json.dumps(message)}\n\n"
+
+    async def close(self):
+        await self.broker.close()
+
+
+def _make_broker(name):
+    queue_size = int(os.getenv("ORDER_EVENTS_QUEUE_SIZE", "100"))
+    if name == "redis":
+        return RedisBroker.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), queue_size=queue_size)
+    return MemoryBroker(queue_size)
+
+
+order_events = OrderEvents(_make_broker(os.getenv("ORDER_EVENTS_BACKEND", "memory")))
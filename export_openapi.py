@@ -0,0 +1,16 @@
+"""
+    Write the OpenAPI schema to a file at build time, so workers can serve it
+    without generating it (set OPENAPI_SCHEMA_PATH to the written file).
+
+        python export_openapi.py openapi.json
+"""
+import json
+import sys
+from main import app
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "openapi.json"
+    with open(path, "w") as f:
+        json.dump(app.openapi(), f)
+    print("OpenAPI schema written to", path)
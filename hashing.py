@@ -0,0 +1,74 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasher:
+    """
+        Hashes and checks passwords in a worker pool so the slow key derivation
+        never runs on the event loop. A semaphore caps how many hashes are queued
+        at once, and hashes made with an outdated method are flagged for rehash.
+    """
+
+    def __init__(self, method, executor="thread", workers=None, concurrency=None):
+        self.method = method
+        self.executor_type = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.concurrency = concurrency or self.workers * 2
+        self._executor = None
+        self._semaphore = None
+        self._prefix = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hasher")
+        return self._executor
+
+    async def _run(self, func):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func)
+
+    async def hash(self, password):
+        return await self._run(partial(generate_password_hash, password, method=self.method))
+
+    async def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return await self._run(partial(check_password_hash, pwhash, password))
+
+    async def needs_rehash(self, pwhash):
+        if self._prefix is None:
+            # werkzeug expands defaults (e.g. "scrypt" -> "scrypt:32768:8:1"), so
+            # compare against the prefix of a hash made with the current method,
+            # made once and in the pool like any other hash
+            self._prefix = (await self.hash("")).split("$", 1)[0]
+        return pwhash.split("$", 1)[0] != self._prefix
+
+    async def verify_and_update(self, pwhash, password):
+        """Check a password and return ``(valid, new_hash)``; ``new_hash`` is set when a rehash is due."""
+        if not await self.verify(pwhash, password):
+            return False, None
+        if await self.needs_rehash(pwhash):
+            return True, await self.hash(password)
+        return True, None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    method=os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1"),
+    executor=os.getenv("PASSWORD_HASH_EXECUTOR", "thread"),
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or None,
+    concurrency=int(os.getenv("PASSWORD_HASH_CONCURRENCY", "0")) or None,
+)
@@ -0,0 +1,225 @@
+"""
+    ``Idempotency-Key`` support for order writes.
+
+    Clients that time out and retry send the same key again. The first request
+    records its response in ``idempotency_keys`` in the same transaction as its
+    changes; a retry gets that response back without running the write again.
+    Recorded responses are also kept in a TTL store (in-process, or Redis with
+    IDEMPOTENCY_BACKEND=redis) so retries usually skip the database lookup.
+    Concurrent requests with the same key wait for the one in flight on this
+    worker; across workers the unique constraint on the key table decides.
+
+        async with idempotency.claim(db, user.id, idempotency_key, "POST /order/order", order.dict()) as request:
+            if request.replay is not None:
+                return request.replay
+            ...  # write, build the response
+            response = await request.save(response)
+            await db.commit()
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from cache import MemoryBackend, RedisBackend
+from database import get_sessionmaker
+from models import IdempotencyKey
+from query_budget import extend_query_budget
+
+logger = logging.getLogger("pizza.idempotency")
+
+# Seconds a key is remembered; a key reused after that runs the request again
+IDEMPOTENCY_KEY_TTL = float(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(scope, payload):
+    """Hash of the route and body a key was first used with, so reusing it for another request is caught."""
+    raw = json.dumps([scope, payload], sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class IdempotentRequest:
+    """One request's claim on its key. ``replay`` is the recorded response when it was seen before."""
+
+    def __init__(self, store, db, user_id, key, fingerprint):
+        self.store = store
+        self.db = db
+        self.user_id = user_id
+        self.key = key
+        self.fingerprint = fingerprint
+        self.replay = None
+        self._future = None
+        self._recorded = None
+
+    async def __aenter__(self):
+        if self.key is None:
+            return self
+        if not self.key or len(self.key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"
+            )
+        # Looking the key up (and deleting it once expired) and recording it
+        # are extra statements on top of the route's own
+        extend_query_budget(3)
+
+        inflight_key = (self.user_id, self.key)
+        while (future := self.store._inflight.get(inflight_key)) is not None:
+            recorded = await asyncio.shield(future)
+            if recorded is not None:
+                self._use(recorded)
+                return self
+            # The request in flight failed, so this one gets to try
+
+        # Claimed before the lookup, so a duplicate arriving meanwhile waits for it
+        self._future = asyncio.get_running_loop().create_future()
+        self.store._inflight[inflight_key] = self._future
+        try:
+            recorded = await self.store.lookup(self.db, self.user_id, self.key)
+        except BaseException:
+            self._release(None)
+            raise
+        if recorded is not None:
+            self._release(recorded)
+            self._use(recorded)
+        return self
+
+    def _release(self, recorded):
+        """Hand ``recorded`` (``None`` if this request failed) to the requests waiting on the key."""
+        self.store._inflight.pop((self.user_id, self.key), None)
+        self._future.set_result(recorded)
+        self._future = None
+
+    def _use(self, recorded):
+        if recorded["fingerprint"] != self.fingerprint:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="This Idempotency-Key was already used for a different request"
+            )
+        self.replay = recorded["response"]
+        self.store.replays += 1
+
+    async def save(self, response):
+        """
+            Record ``response`` alongside the request's uncommitted changes and
+            return the response to send. If another worker committed the same key
+            first, this request's changes are rolled back and its response is returned.
+        """
+        if self.key is None:
+            return response
+        self.db.add(IdempotencyKey(
+            user_id=self.user_id,
+            idempotency_key=self.key,
+            fingerprint=self.fingerprint,
+            response=json.dumps(response, default=str),
+        ))
+        try:
+            await self.db.flush()
+        except IntegrityError:
+            await self.db.rollback()
+            recorded = await self.store.lookup(self.db, self.user_id, self.key)
+            if recorded is None:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still in progress, try again"
+                )
+            self._use(recorded)
+            return self.replay
+        self._recorded = {"fingerprint": self.fingerprint, "response": response}
+        return response
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._future is None:
+            return False
+        recorded = self._recorded if exc_type is None else None
+        try:
+            if recorded is not None:
+                await self.store.cache_set(self.user_id, self.key, recorded)
+        finally:
+            # Waiters replay the response, or try themselves if this request failed
+            self._release(recorded)
+        return False
+
+
+class IdempotencyStore:
+
+    def __init__(self, backend, ttl=86400.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.replays = 0
+        self._inflight = {}
+
+    @staticmethod
+    def cache_key(user_id, key):
+        return f"idempotency:{user_id}:{key}"
+
+    def claim(self, db, user_id, key, scope, payload):
+        """Async context manager for a write sent with ``key`` (``None`` when the client sent none)."""
+        return IdempotentRequest(self, db, user_id, key, request_fingerprint(scope, payload))
+
+    async def cache_get(self, user_id, key):
+        """The recorded response from the cache backend; a failing backend is logged and treated as a miss."""
+        if self.backend is None:
+            return None
+        try:
+            return await self.backend.get(self.cache_key(user_id, key))
+        except Exception:
+            logger.exception("Could not read an idempotency key from the cache, falling back to the database")
+            return None
+
+    async def cache_set(self, user_id, key, recorded):
+        """Cache a recorded response; the database still has it if the backend fails."""
+        if self.backend is None:
+            return
+        try:
+            await self.backend.set(self.cache_key(user_id, key), recorded, self.ttl)
+        except Exception:
+            logger.exception("Could not cache an idempotency key")
+
+    async def lookup(self, db, user_id, key):
+        """The recorded ``{"fingerprint", "response"}`` for a key, or ``None``."""
+        recorded = await self.cache_get(user_id, key)
+        if recorded is not None:
+            return recorded
+
+        row = (await db.execute(
+            select(IdempotencyKey.fingerprint, IdempotencyKey.response, IdempotencyKey.created_at)
+            .filter(IdempotencyKey.user_id == user_id, IdempotencyKey.idempotency_key == key)
+        )).first()
+        if row is None:
+            return None
+        if row.created_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+            # Expired: free the key for this request, committed with its changes
+            await db.execute(delete(IdempotencyKey).filter(
+                IdempotencyKey.user_id == user_id, IdempotencyKey.idempotency_key == key
+            ))
+            return None
+
+        recorded = {"fingerprint": row.fingerprint, "response": json.loads(row.response)}
+        await self.cache_set(user_id, key, recorded)
+        return recorded
+
+    async def purge(self):
+        """Delete expired keys; run by ``python init_db.py purge-keys``."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        async with get_sessionmaker()() as db:
+            result = await db.execute(delete(IdempotencyKey).filter(IdempotencyKey.created_at < cutoff))
+            await db.commit()
+        return result.rowcount
+
+
+def _make_backend(name):
+    if name == "memory":
+        return MemoryBackend(maxsize=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")))
+    if name == "redis":
+        return RedisBackend.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return None
+
+
+idempotency = IdempotencyStore(
+    _make_backend(os.getenv("IDEMPOTENCY_BACKEND", "memory")),
+    ttl=IDEMPOTENCY_KEY_TTL,
+)
@@ -1,5 +1,116 @@
-from database import engine,Base
+"""
+    Database management commands.
+
+        python init_db.py create    create all tables (the default)
+        python init_db.py migrate   apply pending scripts from migrations/
+        python init_db.py status    list migration scripts and whether they ran
+        python init_db.py archive   move old delivered orders to orders_archive
+        python init_db.py purge-keys  delete expired idempotency keys
+        python init_db.py purge-revocations  delete revocations of tokens that have expired
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import text
+from database import create_tables, get_engine, dispose_engine
 from models import User,Order
 
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+
+def migration_files():
+    return sorted(MIGRATIONS_DIR.glob("*.sql"))
+
+
+def split_statements(sql):
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [stmt.strip() for stmt in "\n".join(lines).split(";") if stmt.strip()]
+
+
+async def _ensure_migrations_table(conn):
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "name VARCHAR(255) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"
+    ))
+    return set((await conn.execute(text("SELECT name FROM schema_migrations"))).scalars())
+
+
+async def _record(conn, name):
+    await conn.execute(
+        text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :applied_at)"),
+        {"name": name, "applied_at": datetime.utcnow()},
+    )
+
+
+async def create():
+    # create_all builds the current schema, so every migration counts as applied
+    await create_tables()
+    async with get_engine().begin() as conn:
+        applied = await _ensure_migrations_table(conn)
+        for path in migration_files():
+            if path.name not in applied:
+                await _record(conn, path.name)
+
+
+async def migrate():
+    async with get_engine().begin() as conn:
+        applied = await _ensure_migrations_table(conn)
+    for path in migration_files():
+        if path.name in applied:
+            continue
+        print("Applying", path.name)
+        async with get_engine().begin() as conn:
+            for statement in split_statements(path.read_text()):
+                await conn.exec_driver_sql(statement)
+            await _record(conn, path.name)
+
+
+async def status():
+    async with get_engine().begin() as conn:
+        applied = await _ensure_migrations_table(conn)
+    for path in migration_files():
+        print("applied" if path.name in applied else "pending", path.name)
+
+
+async def archive(older_than_days=None, batch_size=None):
+    from archive import archive_orders
+    moved = await archive_orders(older_than_days, batch_size)
+    print("Archived", moved, "orders")
+
+
+async def purge_keys():
+    from idempotency import idempotency
+    deleted = await idempotency.purge()
+    print("Deleted", deleted, "expired idempotency keys")
+
+
+async def purge_revocations():
+    from revocation import revocations
+    deleted = await revocations.purge()
+    print("Deleted", deleted, "expired token revocations")
+
+
+COMMANDS = {
+    "create": create, "migrate": migrate, "status": status, "archive": archive,
+    "purge-keys": purge_keys, "purge-revocations": purge_revocations,
+}
+
+
+async def main(command, **options):
+    try:
+        await COMMANDS[command](**options)
+    finally:
+        await dispose_engine()
+
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the Pizza Delivery API database")
+    parser.add_argument("command", nargs="?", default="create", choices=list(COMMANDS))
+    parser.add_argument("--older-than-days", type=float, help="archive: delivered orders unchanged for this long (ORDER_ARCHIVE_AFTER_DAYS)")
+    parser.add_argument("--batch-size", type=int, help="archive: orders moved per transaction (ORDER_ARCHIVE_BATCH_SIZE)")
+    args = parser.parse_args()
+    options = {}
+    if args.command == "archive":
+        options = {"older_than_days": args.older_than_days, "batch_size": args.batch_size}
+    asyncio.run(main(args.command, **options))
@@ -1,123 +1,181 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, Depends, Header, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 from fastapi_jwt_auth import AuthJWT
 from schemas import Settings
-import inspect, re
+import json, os
 from fastapi import FastAPI
-from fastapi.routing import APIRoute
 from fastapi.openapi.utils import get_openapi
 
-from database import SessionLocal
+from database import DB_STICKY_PRIMARY_SECONDS, StickyPrimaryMiddleware, get_db, get_read_db, get_engine, get_replica_engine, dispose_engine, pool_stats
+from security import user_cache
+from hashing import password_hasher
+from cache import order_cache
+from events import order_events
+from archive import ORDER_ARCHIVE_INTERVAL, run_archiver
+from order_writer import ORDER_WRITE_BATCHING, order_writer
+from idempotency import idempotency
+from revocation import revocations
 from models import User as UserModel  # Ensure these are correct imports
-from schemas import User, UserCreate, Settings
-from fastapi.responses import JSONResponse
+from schemas import User, UserCreate, UserPage, Settings
+from pagination import PageParams, paginate, page_content, page_response
+from etags import tag_by_body
+from fastapi.responses import JSONResponse, PlainTextResponse
+from metrics import MetricsMiddleware, TimedJSONResponse, instrument_engine, metrics
+from query_budget import QUERY_BUDGET_STRICT, QueryBudgetMiddleware, enable_raiseload, query_budget
+from ratelimit import ConcurrencyLimitMiddleware, concurrency_limiter, rate_limiter
 from auth_routes import auth_router
 from order_routes import order_router
 
 
 
-# Initialize FastAPI app
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Schema changes are applied with `python init_db.py`, never on startup
+    instrument_engine(get_engine())
+    if get_replica_engine() is not None:
+        instrument_engine(get_replica_engine())
+        # A lagging replica can re-cache rows a write just invalidated
+        order_cache.reinvalidate_after = DB_STICKY_PRIMARY_SECONDS
+    archiver = asyncio.create_task(run_archiver()) if ORDER_ARCHIVE_INTERVAL else None
+    if ORDER_WRITE_BATCHING:
+        order_writer.start()
+    # Load the denylist before serving, then keep up with revocations from other workers
+    await revocations.refresh()
+    revocation_sync = asyncio.create_task(revocations.run_sync())
+    yield
+    revocation_sync.cancel()
+    with suppress(asyncio.CancelledError):
+        await revocation_sync
+    if archiver is not None:
+        archiver.cancel()
+        with suppress(asyncio.CancelledError):
+            await archiver
+    # Orders still queued are written before the engine goes away
+    await order_writer.close()
+    await order_events.close()
+    password_hasher.shutdown()
+    await dispose_engine()
 
-# Dependency to get the DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Initialize FastAPI app
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+# Middleware added last runs first: MetricsMiddleware counts the queries QueryBudgetMiddleware checks,
+# and sees the requests ConcurrencyLimitMiddleware sheds. Event streams stay open, so neither counts them.
+STREAMING_PATHS = ("/order/user/orders/events",)
+app.add_middleware(ConcurrencyLimitMiddleware, exempt=STREAMING_PATHS + ("/metrics",))
+app.add_middleware(QueryBudgetMiddleware)
+app.add_middleware(StickyPrimaryMiddleware)
+app.add_middleware(MetricsMiddleware, exempt=STREAMING_PATHS)
+
+if QUERY_BUDGET_STRICT:
+    enable_raiseload()
 
 @app.get("/")
 async def read_root():
     return {"message": "Hello World"}
 
-@app.get("/users", response_model=List[User])
-async def get_users(db: Session = Depends(get_db)):
-    users = db.query(UserModel).all()
-    return users
-
-@app.post("/users", response_model=User)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = UserModel(username=user.username, email=user.email, password=user.password)  # Ensure correct field names
+@app.get("/stats/db")
+async def db_stats():
+    return pool_stats()
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return order_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Per-route latency, DB work and pool/cache usage in the Prometheus text format."""
+    pool = pool_stats()
+    cache = order_cache.stats()
+    gauges = [
+        ("pizza_db_pool_checked_out", "Connections currently checked out", pool.get("checked_out", 0)),
+        ("pizza_db_pool_overflow", "Connections open beyond the pool size", max(pool.get("overflow", 0), 0)),
+        ("pizza_db_pool_wait_seconds_total", "Time spent waiting for a connection", pool.get("wait_time_total", 0)),
+        ("pizza_order_cache_hits", "Order cache hits", cache["hits"]),
+        ("pizza_order_cache_misses", "Order cache misses", cache["misses"]),
+        ("pizza_order_cache_evictions", "Order cache evictions", cache["evictions"]),
+        ("pizza_order_event_subscribers", "Open order status event streams", order_events.broker.subscriber_count()),
+        ("pizza_order_write_queue", "Orders waiting for a batched write", order_writer.queued()),
+        ("pizza_order_write_batches_total", "Batched order writes committed", order_writer.batches),
+        ("pizza_idempotent_replays_total", "Retried writes answered from a recorded response", idempotency.replays),
+        ("pizza_rate_limited_total", "Requests rejected by a rate limit", rate_limiter.rejected),
+        ("pizza_requests_shed_total", "Requests turned away by the concurrency limit", concurrency_limiter.shed),
+        ("pizza_revoked_tokens", "Entries in the in-memory token denylist", len(revocations.denylist)),
+    ]
+    return metrics.render(gauges)
+
+@app.get("/users", response_model=UserPage, dependencies=[Depends(query_budget(1))])
+async def get_users(page: PageParams = Depends(), if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_read_db)):
+    query = select(UserModel.id, UserModel.username, UserModel.email)
+    users, next_cursor = await paginate(db, query, UserModel.id, page)
+    # Users have no version to compare, so the page is tagged by its body
+    return tag_by_body(page_response(page_content(users, next_cursor)), if_none_match)
+
+@app.post("/users", response_model=User, dependencies=[Depends(query_budget(2))])
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = UserModel(username=user.username, email=user.email, password=await password_hasher.hash(user.password))  # Ensure correct field names
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-@app.put("/users/{user_id}", response_model=User)
-def update_user(user_id: int, user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(UserModel).filter(UserModel.id == user_id).first()
+@app.put("/users/{user_id}", response_model=User, dependencies=[Depends(query_budget(3))])
+async def update_user(user_id: int, user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.get(UserModel, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User Not Found")
     
     # Update only the fields that are provided in the request body
     if user.username:
-        db_user.username = user.name  # type: ignore # Use `username` if your model uses that field
+        db_user.username = user.username  # type: ignore
     if user.email:
         db_user.email = user.email # type: ignore
     if user.password:
-        db_user.password = user.password # type: ignore
+        db_user.password = await password_hasher.hash(user.password) # type: ignore
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    user_cache.invalidate(user_id=user_id)
     return db_user
 
-@app.delete("/users/{user_id}", response_class=JSONResponse)
-def delete_user(user_id: int, db: Session = Depends(get_db)):
+# Loading the user and their orders, detaching the orders, deleting the user and revoking their tokens
+@app.delete("/users/{user_id}", response_class=JSONResponse, dependencies=[Depends(query_budget(5))])
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
     try:
-        db_user = db.query(UserModel).filter(UserModel.id == user_id).first()
+        db_user = await db.get(UserModel, user_id)
         if not db_user:
             raise HTTPException(status_code=404, detail="User Not Found")
-        db.delete(db_user)
-        db.commit()
+        await db.delete(db_user)
+        # Identity comes from token claims, so the user's tokens must stop working too; commits the delete
+        await revocations.revoke_subject(db, db_user.username)
+        user_cache.invalidate(user_id=user_id)
         return {f"user of id {user_id} has been deleted": True}
     except:
         raise HTTPException(status_code=404, detail="User Not Found")
 
-# Include routers from other modules
+# OpenAPI schema, built once. Set OPENAPI_SCHEMA_PATH to serve a schema
+# exported at build time with `python export_openapi.py`.
+OPENAPI_SCHEMA_PATH = os.getenv("OPENAPI_SCHEMA_PATH")
+
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
 
-    openapi_schema = get_openapi(
+    if OPENAPI_SCHEMA_PATH and os.path.exists(OPENAPI_SCHEMA_PATH):
+        with open(OPENAPI_SCHEMA_PATH) as f:
+            app.openapi_schema = json.load(f)
+        return app.openapi_schema
+
+    # Secured routes are found from their jwt_required dependency (security.bearer_scheme)
+    app.openapi_schema = get_openapi(
         title = "Pizza Delivery API",
         version = "1.0",
         description = "An API for a Pizza Delivery Service",
         routes = app.routes,
     )
-
-    openapi_schema["components"]["securitySchemes"] = {
-        "Bearer Auth": {
-            "type": "apiKey",
-            "in": "header",
-            "name": "Authorization",
-            "description": "Enter: **'Bearer &lt;JWT&gt;'**, where JWT is the access token"
-        }
-    }
-
-    # Get all routes where jwt_optional() or jwt_required
-    api_router = [route for route in app.routes if isinstance(route, APIRoute)]
-
-    for route in api_router:
-        path = getattr(route, "path")
-        endpoint = getattr(route,"endpoint")
-        methods = [method.lower() for method in getattr(route, "methods")]
-
-        for method in methods:
-            # access_token
-            if (
-                re.search("jwt_required", inspect.getsource(endpoint)) or
-                re.search("fresh_jwt_required", inspect.getsource(endpoint)) or
-                re.search("jwt_optional", inspect.getsource(endpoint))
-            ):
-                openapi_schema["paths"][path][method]["security"] = [
-                    {
-                        "Bearer Auth": []
-                    }
-                ]
-
-    app.openapi_schema = openapi_schema
     return app.openapi_schema
 
 
@@ -129,5 +187,9 @@ app.openapi = custom_openapi
 def get_config():
     return Settings()
 
+@AuthJWT.token_in_denylist_loader # type: ignore
+def token_is_revoked(decrypted_token):
+    return revocations.is_revoked(decrypted_token)
+
 app.include_router(auth_router)
 app.include_router(order_router)
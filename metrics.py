@@ -0,0 +1,200 @@
+import logging
+import os
+import time
+from contextvars import ContextVar
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import event
+
+logger = logging.getLogger("pizza.metrics")
+
+# Requests slower than this are logged with their queries; 0 disables the log
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    """Database and serialization work done while handling one request."""
+
+    __slots__ = ("queries", "db_time", "rows_written", "serialization_time", "statements", "query_budget")
+
+    def __init__(self, record_statements=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows_written = 0
+        self.serialization_time = 0.0
+        self.statements = [] if record_statements else None
+        self.query_budget = None
+
+
+request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """In-process registry rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = {}
+        self.latency = {}
+        self.queries = {}
+        self.db_time = {}
+        self.rows_written = {}
+        self.serialization_time = {}
+
+    def observe(self, method, route, status_code, elapsed, stats):
+        key = (method, route)
+        self.requests[key + (status_code,)] = self.requests.get(key + (status_code,), 0) + 1
+        self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+        self.queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+        self.db_time[key] = self.db_time.get(key, 0.0) + stats.db_time
+        self.rows_written[key] = self.rows_written.get(key, 0) + stats.rows_written
+        self.serialization_time[key] = self.serialization_time.get(key, 0.0) + stats.serialization_time
+
+    def render(self, gauges=()):
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, help_text, series):
+            header(name, "histogram", help_text)
+            for (method, route), h in sorted(series.items()):
+                labels = f'method="{method}",route="{route}"'
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+                lines.append(f"{name}_sum{{{labels}}} {h.sum}")
+                lines.append(f"{name}_count{{{labels}}} {h.count}")
+
+        def counter(name, help_text, series):
+            header(name, "counter", help_text)
+            for (method, route), value in sorted(series.items()):
+                lines.append(f'{name}{{method="{method}",route="{route}"}} {value}')
+
+        header("pizza_http_requests_in_flight", "gauge", "Requests currently being handled")
+        lines.append(f"pizza_http_requests_in_flight {self.in_flight}")
+
+        header("pizza_http_requests_total", "counter", "Requests handled")
+        for (method, route, code), value in sorted(self.requests.items()):
+            lines.append(f'pizza_http_requests_total{{method="{method}",route="{route}",status="{code}"}} {value}')
+
+        histogram("pizza_http_request_duration_seconds", "Request latency", self.latency)
+        histogram("pizza_db_queries_per_request", "Database queries issued per request", self.queries)
+        counter("pizza_db_query_seconds_total", "Time spent in database queries", self.db_time)
+        counter("pizza_db_rows_written_total", "Rows inserted, updated or deleted", self.rows_written)
+        counter("pizza_serialization_seconds_total", "Time spent rendering response bodies", self.serialization_time)
+
+        for name, help_text, value in gauges:
+            header(name, "gauge", help_text)
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """
+        ASGI middleware recording latency, in-flight requests and per-request DB
+        work. Long-lived streams under the ``exempt`` path prefixes are not
+        recorded, so they don't skew the in-flight gauge and latency histogram.
+    """
+
+    def __init__(self, app, exempt=()):
+        self.app = app
+        self.exempt = tuple(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(record_statements=SLOW_REQUEST_MS > 0)
+        token = request_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.in_flight -= 1
+            request_stats.reset(token)
+
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            metrics.observe(scope["method"], route_path, status_code, elapsed, stats)
+
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                logger.warning(
+                    "Slow request %s %s: %.1f ms, %d queries (%.1f ms)\n%s",
+                    scope["method"], scope["path"], elapsed * 1000, stats.queries,
+                    stats.db_time * 1000, "\n".join(stats.statements),
+                )
+
+
+class TimedJSONResponse(ORJSONResponse):
+    """orjson response that records how long rendering the body took."""
+
+    def render(self, content):
+        start = time.perf_counter()
+        body = super().render(content)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.serialization_time += time.perf_counter() - start
+        return body
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = request_stats.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_time += elapsed
+    # Drivers only report a reliable rowcount for writes (SELECTs often give -1)
+    if context is not None and (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount > 0:
+        stats.rows_written += cursor.rowcount
+    if stats.statements is not None:
+        stats.statements.append(f"  {elapsed * 1000:.1f} ms  {statement}")
+
+
+def instrument_engine(engine):
+    """Attach the query hooks to an (async) engine; safe to call more than once."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
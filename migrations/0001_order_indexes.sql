@@ -0,0 +1,8 @@
+-- Indexes for per-user order lookups, keyset pagination and status filters.
+-- Matches Order.__table_args__ in models.py; fresh databases get them from create_all.
+-- Built online so the orders table stays writable during the migration.
+ALTER TABLE orders
+    ADD INDEX ix_orders_user_id_id (user_id, id),
+    ADD INDEX ix_orders_order_status_id (order_status, id),
+    ADD INDEX ix_orders_pizza_size_id (pizza_size, id),
+    ALGORITHM=INPLACE, LOCK=NONE;
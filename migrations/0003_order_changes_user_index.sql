@@ -0,0 +1,6 @@
+-- Per-user lookups of the latest order change, used for the ETags of order lists.
+-- Matches OrderChange.__table_args__ in models.py; fresh databases get it from create_all.
+-- Built online so the change log stays writable during the migration.
+ALTER TABLE order_changes
+    ADD INDEX ix_order_changes_user_id_id (user_id, id),
+    ALGORITHM=INPLACE, LOCK=NONE;
@@ -0,0 +1,13 @@
+-- Cold storage for delivered orders, filled by `python init_db.py archive`.
+-- Matches OrderArchive in models.py; fresh databases get it from create_all.
+CREATE TABLE orders_archive (
+    id INT NOT NULL PRIMARY KEY,
+    quantity INT NOT NULL,
+    order_status VARCHAR(50) NULL,
+    pizza_size VARCHAR(50) NULL,
+    user_id INT NULL,
+    version INT NOT NULL,
+    updated_at DATETIME NULL,
+    archived_at DATETIME NOT NULL,
+    INDEX ix_orders_archive_user_id_id (user_id, id)
+) ENGINE=InnoDB;
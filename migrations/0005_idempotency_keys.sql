@@ -0,0 +1,12 @@
+-- Responses recorded for Idempotency-Key headers (idempotency.py).
+-- Matches IdempotencyKey in models.py; fresh databases get it from create_all.
+CREATE TABLE idempotency_keys (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    fingerprint CHAR(64) NOT NULL,
+    response TEXT NOT NULL,
+    created_at DATETIME NOT NULL,
+    UNIQUE KEY uq_idempotency_keys_user_id_key (user_id, idempotency_key),
+    INDEX ix_idempotency_keys_created_at (created_at)
+) ENGINE=InnoDB;
@@ -0,0 +1,12 @@
+-- Revoked tokens behind /auth/logout and staff revoke-all (revocation.py).
+-- Matches TokenRevocation in models.py; fresh databases get it from create_all.
+CREATE TABLE token_revocations (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    jti VARCHAR(64) NULL,
+    subject VARCHAR(50) NULL,
+    revoked_before INT NULL,
+    expires_at DATETIME NOT NULL,
+    created_at DATETIME NOT NULL,
+    INDEX ix_token_revocations_created_at (created_at),
+    INDEX ix_token_revocations_expires_at (expires_at)
+) ENGINE=InnoDB;
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Boolean, Text, DateTime, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -32,4 +33,98 @@ class Order(Base):
     order_status = Column(String(50), default="PENDING")  # Use String instead of ChoiceType for MySQL
     pizza_size = Column(String(50), default="SMALL")  # Use String instead of ChoiceType for MySQL
     user_id = Column(Integer, ForeignKey('users.id'))
+    # Bumped by every write (crud.update_order, crud.update_orders_status)
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user = relationship('User', back_populates='orders')
+
+    # Keyset pagination walks `id` within each filter, and (user_id, id) also
+    # serves single-order lookups scoped to a user.
+    # Existing MySQL databases: see migrations/0001_order_indexes.sql
+    __table_args__ = (
+        Index('ix_orders_user_id_id', 'user_id', 'id'),
+        Index('ix_orders_order_status_id', 'order_status', 'id'),
+        Index('ix_orders_pizza_size_id', 'pizza_size', 'id'),
+    )
+
+class OrderArchive(Base):
+    """
+        Delivered orders moved out of ``orders`` by archive.py, keeping their ids.
+        Lookups by id and by user fall back to this table; it is never updated.
+        Existing MySQL databases: see migrations/0004_orders_archive.sql
+    """
+    __tablename__ = "orders_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    quantity = Column(Integer, nullable=False)
+    order_status = Column(String(50))
+    pizza_size = Column(String(50))
+    user_id = Column(Integer)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_orders_archive_user_id_id', 'user_id', 'id'),
+    )
+
+class OrderChange(Base):
+    """
+        Append-only log of order writes, read by the ``/order/changes`` feed.
+        ``id`` is the feed cursor; deleted orders leave a tombstone here.
+        Existing MySQL databases: see migrations/0002_order_changes.sql and
+        0003_order_changes_user_index.sql
+    """
+    __tablename__ = "order_changes"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, nullable=False)
+    user_id = Column(Integer)
+    version = Column(Integer, nullable=False)
+    deleted = Column(Boolean, nullable=False, default=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # The latest change per user tags that user's order lists (etags.py)
+    __table_args__ = (
+        Index('ix_order_changes_user_id_id', 'user_id', 'id'),
+    )
+
+class IdempotencyKey(Base):
+    """
+        Responses recorded for ``Idempotency-Key`` headers (idempotency.py), so
+        a retried request is answered without being executed again. The key row
+        is written in the same transaction as the request's changes.
+        Existing MySQL databases: see migrations/0005_idempotency_keys.sql
+    """
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    idempotency_key = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # The unique key makes concurrent requests with the same key on different workers collide
+    __table_args__ = (
+        UniqueConstraint('user_id', 'idempotency_key', name='uq_idempotency_keys_user_id_key'),
+        Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
+
+class TokenRevocation(Base):
+    """
+        Durable record of revoked tokens, loaded into each worker's in-memory
+        denylist (revocation.py). A row revokes one token by ``jti``, or every
+        token of ``subject`` issued at or before ``revoked_before`` (epoch seconds).
+        Existing MySQL databases: see migrations/0006_token_revocations.sql
+    """
+    __tablename__ = "token_revocations"
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(64))
+    subject = Column(String(50))
+    revoked_before = Column(Integer)
+    # Once every token the row covers has expired, it can be deleted
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_token_revocations_created_at', 'created_at'),
+        Index('ix_token_revocations_expires_at', 'expires_at'),
+    )
@@ -1,258 +1,507 @@
-from fastapi import APIRouter, Depends,status
-from fastapi_jwt_auth import AuthJWT
-from models import User, Order
-from schemas import OrderModel, OrderStatusModel
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from models import Order, OrderArchive
+from schemas import (OrderModel, OrderStatusModel, BulkOrderModel, BulkOrderStatusModel,
+    OrderResponse, OrderPage, BulkOrderResponse, BulkOrderStatusResponse, OrderChangesPage)
 from fastapi.exceptions import HTTPException
-from database import SessionLocal
-from sqlalchemy.orm import Session
-from fastapi.encoders import jsonable_encoder
+from database import DATABASE_REPLICA_URL, get_db, get_read_db, stick_to_primary
+from security import CurrentUser, get_current_user, jwt_required
+from pagination import (MAX_PAGE_SIZE, PageParams, decode_changes_cursor, encode_cursor, paginate, paginate_union,
+    page_content, page_response)
+from crud import (ORDER_COLUMNS, ORDER_STATUSES, order_columns, order_errors, insert_orders, update_orders_status,
+    update_order as update_order_row, delete_order,
+    record_order_changes, order_changes, change_log_gaps, user_orders_version)
+from etags import order_etag, list_etag, check_not_modified, if_match_version
+from cache import order_cache
+from events import order_events
+from order_writer import OrderWriterBusy, order_writer
+from idempotency import idempotency
+from query_budget import query_budget
+from ratelimit import rate_limit
+from export import MEDIA_TYPES, export_columns, naive_utc, stream_orders
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 order_router=APIRouter(
      prefix='/order',
     tags=['order']
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def load_order(db, if_none_match, id, user_id=None):
+    """
+        Load an order (only if it belongs to ``user_id``, when given) as a dict,
+        or ``None``. Delivered orders moved to the archive are found there.
+        When the client sent an ETag, only the version is read first and an
+        unchanged order is answered with a 304 without fetching the row.
+    """
+    for model in (Order, OrderArchive):
+        conditions=[model.id==id]
+        if user_id is not None:
+            conditions.append(model.user_id==user_id)
+
+        if if_none_match:
+            version=(await db.execute(select(model.version).filter(*conditions))).scalar()
+            if version is None:
+                continue
+            check_not_modified(if_none_match, order_etag(id, version))
+
+        order=(await db.execute(select(*order_columns(model)).filter(*conditions))).first()
+        if order is not None:
+            return order._asdict()
+    return None
+
+async def order_write_missed(db, id, expected_version):
+    """The error for an order write that matched no row: a missing order, or one past its If-Match version."""
+    if expected_version is not None and (await db.execute(select(Order.id).filter(Order.id==id))).first() is not None:
+        return HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The order has changed since the If-Match version"
+        )
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+        detail="No order with such id"
+    )
 
-@order_router.get('/')
-async def hello(Authorize:AuthJWT=Depends()):
+@order_router.get('/', dependencies=[Depends(jwt_required)])
+async def hello():
     """
         ## A sample hello world route
         This returns Hello world
     """
-    try:
-        Authorize.jwt_required()
-
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Invalid Token"
-        )
-
     return {"message" : "Hello World"}
 
-@order_router.post('/order',status_code=status.HTTP_201_CREATED)
-async def place_an_order(order:OrderModel, Authorize:AuthJWT=Depends(), db: Session = Depends(get_db)):
+@order_router.post('/order',status_code=status.HTTP_201_CREATED, response_model=OrderResponse, dependencies=[Depends(rate_limit("place_order")), Depends(query_budget(2))])
+async def place_an_order(order:OrderModel, http_request:Request, current_user:CurrentUser=Depends(get_current_user), idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
     """
         ## Placing an Order
         This requires the following
         - quantity : integer
         - pizza_size: str
+
+        Send an `Idempotency-Key` header to retry safely: a repeated key
+        returns the first response instead of placing another order.
+
+        With ORDER_WRITE_BATCHING on, the order is committed together with
+        other orders placed within a few milliseconds (see order_writer.py).
     
     """
-    try:
-        Authorize.jwt_required()
-
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Invalid Token"
+    error=order_errors(order)
+    if error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error)
+
+    if order_writer.running and idempotency_key is None:
+        row={"pizza_size":order.pizza_size, "quantity":int(order.quantity), "user_id":current_user.id}
+        try:
+            order_id=await order_writer.submit(row)
+        except OrderWriterBusy:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many orders are waiting to be placed, try again",
+                headers={"Retry-After": "1"}
+            )
+        # The writer commits on its own session, so the read-your-writes window is opened here
+        if DATABASE_REPLICA_URL:
+            stick_to_primary(http_request)
+        await order_cache.invalidate(user_ids=[current_user.id])
+        return {"id":order_id, "order_status":"PENDING", "version":1, **row}
+
+    async with idempotency.claim(db, current_user.id, idempotency_key, "POST /order/order", order.dict()) as request:
+        if request.replay is not None:
+            return request.replay
+
+        new_order=Order(
+            pizza_size=order.pizza_size,
+            quantity=int(order.quantity),
+            user_id=current_user.id
         )
-    current_user=Authorize.get_jwt_subject()
-    user = db.query(User).filter(User.username==current_user).first()
 
-    new_order=Order(
-        pizza_size=order.pizza_size,
-        quantity=order.quantity
-    )
+        db.add(new_order)
+        await db.flush()
+        await record_order_changes(db, [(new_order.id, new_order.user_id, new_order.version)])
 
-    new_order.user=user
-    db.add(new_order)
-    db.commit()
+        response={
+            "id":new_order.id,
+            "pizza_size":new_order.pizza_size,
+            "quantity":new_order.quantity,
+            "order_status":new_order.order_status,
+            "user_id":new_order.user_id,
+            "version":new_order.version
+        }
+        response=await request.save(response)
+        await db.commit()
+
+    await order_cache.invalidate(user_ids=[current_user.id])
+    return response
+
+@order_router.post('/orders/bulk',status_code=status.HTTP_201_CREATED, response_model=BulkOrderResponse, dependencies=[Depends(rate_limit("bulk_orders")), Depends(query_budget(2))])
+async def place_bulk_orders(bulk:BulkOrderModel, current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+        ## Placing many orders at once
+        This requires a list of `orders` (up to 500), each with
+        - quantity : integer
+        - pizza_size: str
 
-    response={
-        "id":new_order.id,
-        "pizza_size":new_order.pizza_size,
-        "quantity":new_order.quantity,
-        "order_status":new_order.order_status
-    }
-    
-    return jsonable_encoder(response)
+        All valid orders are inserted in one statement and one transaction, and
+        their ids are returned in request order. Invalid items are reported by
+        index in `errors`; unless `allow_partial` is true, any invalid item
+        rejects the whole batch.
+    """
+    errors=[]
+    rows=[]
+    for index, order in enumerate(bulk.orders):
+        error=order_errors(order)
+        if error:
+            errors.append({"index":index, "detail":error})
+        else:
+            rows.append({
+                "quantity":int(order.quantity),
+                "pizza_size":order.pizza_size,
+                "user_id":current_user.id
+            })
+
+    if errors and not bulk.allow_partial:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail={"errors":errors}
+        )
+
+    ids=await insert_orders(db, rows)
+    await record_order_changes(db, [(order_id, current_user.id, 1) for order_id in ids])
+    await db.commit()
+    await order_cache.invalidate(user_ids=[current_user.id])
 
-@order_router.get('/order')
-async def list_all_orders(Authorize:AuthJWT=Depends(), db: Session = Depends(get_db)):
+    return {"ids":ids, "errors":errors}
+
+@order_router.get('/order', response_model=OrderPage, dependencies=[Depends(rate_limit("list_orders")), Depends(query_budget(1))])
+async def list_all_orders(order_status:Optional[str]=None, pizza_size:Optional[str]=None, user_id:Optional[int]=None,
+        page:PageParams=Depends(), current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
     """
         ## List all orders
         This lists all  orders made. It can be accessed by superusers
         
-    
+        Results are paginated: pass `next_cursor` back as `cursor` to get the next page.
+        They can be filtered by `order_status`, `pizza_size` and `user_id`.
     """
-    try:
-        Authorize.jwt_required()
-
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Invalid Token"
-        )
-    current_user=Authorize.get_jwt_subject()
-    user = db.query(User).filter(User.username==current_user).first()
-
-    if user.is_staff: # type: ignore
-        orders=db.query(Order).all()
-        return jsonable_encoder(orders)
+    if current_user.is_staff:
+        query=select(*ORDER_COLUMNS)
+        if order_status is not None:
+            query=query.filter(Order.order_status==order_status)
+        if pizza_size is not None:
+            query=query.filter(Order.pizza_size==pizza_size)
+        if user_id is not None:
+            query=query.filter(Order.user_id==user_id)
+
+        orders, next_cursor=await paginate(db, query, Order.id, page)
+        return page_response(page_content(orders, next_cursor))
     
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="You are not a superuser"
         )
 
-@order_router.get('/orders/{id}')
-async def get_order_by_id(id:int, Authorize:AuthJWT=Depends(), db: Session = Depends(get_db)):
+@order_router.get('/export', response_class=StreamingResponse, dependencies=[Depends(rate_limit("export")), Depends(query_budget(2))])
+async def export_orders(format:str=Query("ndjson", regex="^(ndjson|csv)$"), order_status:Optional[str]=None, pizza_size:Optional[str]=None,
+        updated_after:Optional[datetime]=None, updated_before:Optional[datetime]=None, include_archived:bool=True,
+        current_user:CurrentUser=Depends(get_current_user)):
     """
-        ## Get an order by its ID
-        This gets an order by its ID and is only accessed by a superuser
-        
+        ## Export orders
+        This streams every order as NDJSON (one JSON object per line) or, with
+        `format=csv`, as CSV with a header row. It can be accessed by superusers.
 
+        Orders can be filtered by `order_status`, `pizza_size` and by when they
+        last changed (`updated_after` / `updated_before`, ISO 8601). Archived
+        orders are included unless `include_archived=false`.
     """
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Invalid Token"
+    if not current_user.is_staff:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="You are not a superuser"
         )
-    user=Authorize.get_jwt_subject()
 
-    current_user=db.query(User).filter(User.username==user).first()
-
-    if current_user.is_staff: # type: ignore
-        order=db.query(Order).filter(Order.id==id).first()
+    models=[Order, OrderArchive] if include_archived else [Order]
+    statements=[]
+    for model in models:
+        query=select(*export_columns(model))
+        if order_status is not None:
+            query=query.filter(model.order_status==order_status)
+        if pizza_size is not None:
+            query=query.filter(model.pizza_size==pizza_size)
+        if updated_after is not None:
+            query=query.filter(model.updated_at>=naive_utc(updated_after))
+        if updated_before is not None:
+            query=query.filter(model.updated_at<naive_utc(updated_before))
+        statements.append(query.order_by(model.id))
+
+    return StreamingResponse(stream_orders(statements, format), media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition":f'attachment; filename="orders.{format}"'}
+    )
 
-        return jsonable_encoder(order)
+@order_router.get('/orders/{id}', response_model=OrderResponse, dependencies=[Depends(query_budget(3))])
+async def get_order_by_id(id:int, response:Response, if_none_match:Optional[str]=Header(None),
+        current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
+    """
+        ## Get an order by its ID
+        This gets an order by its ID and is only accessed by a superuser
+        
+        The response has an `ETag`; send it back in `If-None-Match` to get a
+        `304` when the order hasn't changed.
+    """
+    if current_user.is_staff:
+        order=await order_cache.get_order(id)
+        if order is None:
+            order=await load_order(db, if_none_match, id)
+            if order is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                    detail="No order with such id"
+                )
+            await order_cache.set_order(id, order)
+
+        etag=order_etag(id, order["version"])
+        check_not_modified(if_none_match, etag)
+        response.headers["ETag"]=etag
+        return order
     
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="User not alowed to carry out request"
         )
 
+@order_router.get('/changes', response_model=OrderChangesPage, dependencies=[Depends(query_budget(1))])
+async def list_order_changes(since:Optional[str]=None, limit:int=Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+        ## Orders changed since a cursor
+        This returns the orders placed, updated or deleted after `since`, in the
+        order they changed, with `next_cursor` to pass as `since` next time.
+        Deleted orders come back with `deleted` set and no other fields. Start
+        without `since` to load every order; while `has_more` is true there are
+        more changes waiting. It can be accessed by superusers
+    """
+    if not current_user.is_staff:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="You are not a superuser"
+        )
+
+    since_id, gaps=decode_changes_cursor(since)
+    rows, has_more=await order_changes(db, since_id, limit, gaps)
+
+    # An order changed several times in the window is sent once, in the position of its last change
+    changes={}
+    for row in rows:
+        changes.pop(row.order_id, None)
+        if row.id is None:
+            changes[row.order_id]={"id":row.order_id, "version":row.change_version, "deleted":True}
+        else:
+            changes[row.order_id]={
+                "id":row.id,
+                "quantity":row.quantity,
+                "order_status":row.order_status,
+                "pizza_size":row.pizza_size,
+                "user_id":row.user_id,
+                "version":row.version,
+                "deleted":False
+            }
+
+    next_cursor=encode_cursor(*change_log_gaps(since_id, gaps, rows))
+    return page_response({"items":list(changes.values()), "next_cursor":next_cursor, "has_more":has_more})
+
 #get current user order
-@order_router.get('/user/orders')
-async def get_user_order(Authorize:AuthJWT=Depends(), db: Session = Depends(get_db)):
+@order_router.get('/user/orders', response_model=OrderPage, dependencies=[Depends(query_budget(2))])
+async def get_user_order(order_status:Optional[str]=None, pizza_size:Optional[str]=None, if_none_match:Optional[str]=Header(None),
+        page:PageParams=Depends(), current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
     """
         ## Get a current user's orders
-        This lists the orders made by the currently logged in users
+        This lists the orders made by the currently logged in users, including archived ones
     
+        Results are paginated: pass `next_cursor` back as `cursor` to get the next page.
+        They can be filtered by `order_status` and `pizza_size`.
+        The response has an `ETag`; send it back in `If-None-Match` to get a
+        `304` when none of the user's orders changed.
     """
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Invalid Token"
-        )
-    user=Authorize.get_jwt_subject()
-    current_user=db.query(User).filter(User.username==user).first()
+    page_key=f"{page.cursor}:{page.limit}:{order_status}:{pizza_size}"
+    cached=await order_cache.get_user_orders(current_user.id, page_key)
+    if cached is not None:
+        check_not_modified(if_none_match, cached["etag"])
+        return page_response(cached["page"], headers={"ETag":cached["etag"]})
+
+    # Read the version before the page, so a concurrent write can only make the tag older than the data
+    etag=list_etag(current_user.id, await user_orders_version(db, current_user.id), page_key)
+    check_not_modified(if_none_match, etag)
+
+    # Archived (delivered) orders are listed along with the live ones
+    queries=[]
+    for model in (Order, OrderArchive):
+        query=select(*order_columns(model)).filter(model.user_id==current_user.id)
+        if order_status is not None:
+            query=query.filter(model.order_status==order_status)
+        if pizza_size is not None:
+            query=query.filter(model.pizza_size==pizza_size)
+        queries.append((query, model.id))
+
+    orders, next_cursor=await paginate_union(db, queries, page)
+
+    response=page_content(orders, next_cursor)
+    await order_cache.set_user_orders(current_user.id, page_key, {"etag":etag, "page":response})
+    return page_response(response, headers={"ETag":etag})
+
+@order_router.get('/user/orders/events', response_class=StreamingResponse, dependencies=[Depends(query_budget(1))])
+async def order_status_events(current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+        ## Stream status changes of the current user's orders
+        This is a Server-Sent Events stream (`text/event-stream`). Every status
+        change of one of the user's orders is pushed as an `order_status` event
+        with the order's `id` and new `order_status`, instead of the client
+        polling `/user/orders`. Re-fetch the orders after reconnecting, since
+        changes made while disconnected are not replayed.
+    """
+    # The stream stays open for as long as the client listens: don't hold a DB connection for it
+    await db.close()
 
-    return jsonable_encoder(current_user.orders) # type: ignore
+    return StreamingResponse(order_events.stream(current_user.id), media_type="text/event-stream",
+        headers={"Cache-Control":"no-cache", "X-Accel-Buffering":"no"}
+    )
 
 #get specific order
-@order_router.get('/user/order/{id}/')
-async def get_specific_order(id:int,Authorize:AuthJWT=Depends(), db: Session = Depends(get_db)):
+@order_router.get('/user/order/{id}/', response_model=OrderResponse, dependencies=[Depends(query_budget(3))])
+async def get_specific_order(id:int, response:Response, if_none_match:Optional[str]=Header(None),
+        current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
     """
         ## Get a specific order by the currently logged in user
         This returns an order by ID for the currently logged in user
     
+        The response has an `ETag`; send it back in `If-None-Match` to get a
+        `304` when the order hasn't changed.
     """
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid Token"
-        )
-
-    subject=Authorize.get_jwt_subject()
-
-    current_user=db.query(User).filter(User.username==subject).first()
-
-    orders=current_user.orders # type: ignore
-
-    for o in orders:
-        if o.id == id:
-            return jsonable_encoder(o)
+    order=await order_cache.get_order(id)
+    if order is None or order["user_id"]!=current_user.id:
+        order=await load_order(db, if_none_match, id, current_user.id)
+        if order is not None:
+            await order_cache.set_order(id, order)
+
+    if order is not None:
+        etag=order_etag(id, order["version"])
+        check_not_modified(if_none_match, etag)
+        response.headers["ETag"]=etag
+        return order
     
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
         detail="No order with such id"
     )
 
-@order_router.put('/order/update/{id}/')
-async def update_order(id:int,order:OrderModel,Authorize:AuthJWT=Depends(), db: Session = Depends(get_db)):
+@order_router.put('/order/update/{id}/', response_model=OrderResponse, dependencies=[Depends(query_budget(3))])
+async def update_order(id:int,order:OrderModel, current_user:CurrentUser=Depends(get_current_user), idempotency_key: Optional[str] = Header(None), if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
     """
         ## Updating an order
         This udates an order and requires the following fields
         - quantity : integer
         - pizza_size: str
+
+        A repeated `Idempotency-Key` header returns the first response.
+        With `If-Match: <ETag>` the order is only updated if it is still at that version, else `412`.
     
     """
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid Token"
-        )
-    order_to_update=db.query(Order).filter(Order.id==id).first()
+    error=order_errors(order)
+    if error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error)
 
-    order_to_update.quantity=order.quantity # type: ignore
-    order_to_update.pizza_size=order.pizza_size # type: ignore
+    expected_version=if_match_version(if_match, id)
+    async with idempotency.claim(db, current_user.id, idempotency_key, f"PUT /order/order/update/{id}/", order.dict()) as request:
+        if request.replay is not None:
+            return request.replay
 
-    db.commit()
-    
-    response={
-                "id":order_to_update.id, # type: ignore
-                "quantity":order_to_update.quantity, # type: ignore
-                "pizza_size":order_to_update.pizza_size, # type: ignore
-                "order_status":order_to_update.order_status, # type: ignore
-            }
-    return jsonable_encoder(order_to_update)
+        response=await update_order_row(db, id, {"quantity":int(order.quantity), "pizza_size":order.pizza_size}, expected_version)
+        if response is None:
+            raise await order_write_missed(db, id, expected_version)
+
+        await record_order_changes(db, [(id, response["user_id"], response["version"])])
+        response=await request.save(response)
+        await db.commit()
+
+    await order_cache.invalidate(order_ids=[id], user_ids=[response["user_id"]])
+    return response
     
 
-@order_router.patch('/order/update/{id}')
-async def update_order_status(id:int,order:OrderStatusModel,Authorize:AuthJWT=Depends(), db: Session = Depends(get_db)):
+@order_router.patch('/order/update/{id}', response_model=OrderResponse, dependencies=[Depends(query_budget(3))])
+async def update_order_status(id:int,order:OrderStatusModel,current_user:CurrentUser=Depends(get_current_user), idempotency_key: Optional[str] = Header(None), if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
     """
         ## Update an order's status
-        This is for updating an order's status and requires ` order_status ` in str format
+        This is for updating an order's status and requires ` order_status ` in str format.
+        A repeated `Idempotency-Key` header returns the first response.
+        With `If-Match: <ETag>` the order is only updated if it is still at that version, else `412`.
     """
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid Token"
-        )
-    username=Authorize.get_jwt_subject()
-    current_user=db.query(User).filter(User.username==username).first()
-
-    if current_user.is_staff: # type: ignore
-        order_to_update=db.query(Order).filter(Order.id==id).first()
-        order_to_update.order_status = order.order_status # type: ignore
-
-        db.commit()
-        response={
-                "id":order_to_update.id, # type: ignore
-                "quantity":order_to_update.quantity, # type: ignore
-                "pizza_size":order_to_update.pizza_size, # type: ignore
-                "order_status":order_to_update.order_status, # type: ignore
-            }
-        return jsonable_encoder(response)
+    if current_user.is_staff:
+        expected_version=if_match_version(if_match, id)
+        async with idempotency.claim(db, current_user.id, idempotency_key, f"PATCH /order/order/update/{id}", order.dict()) as request:
+            if request.replay is not None:
+                return request.replay
+
+            response=await update_order_row(db, id, {"order_status":order.order_status}, expected_version)
+            if response is None:
+                raise await order_write_missed(db, id, expected_version)
+
+            await record_order_changes(db, [(id, response["user_id"], response["version"])])
+            response=await request.save(response)
+            await db.commit()
+
+        await order_cache.invalidate(order_ids=[id], user_ids=[response["user_id"]])
+        await order_events.publish_status([(id, response["user_id"], response["order_status"])])
+        return response
     
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="You are not a superuser"
         )
 
-@order_router.delete('/order/delete/{id}', status_code=status.HTTP_204_NO_CONTENT)
-async def delete_an_order(id:int,Authorize:AuthJWT=Depends(), db: Session = Depends(get_db)):
+@order_router.patch('/orders/status', response_model=BulkOrderStatusResponse, dependencies=[Depends(query_budget(3))])
+async def update_orders_status_bulk(bulk:BulkOrderStatusModel, current_user:CurrentUser=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """
-        ## Delete an Order
-        This deletes an order by its ID
+        ## Update the status of many orders
+        This moves every selected order to ` order_status ` with a single UPDATE.
+        Orders are selected by a list of `ids` and/or the filters
+        `current_status`, `pizza_size` and `user_id`; at least one is required.
+        It can be accessed by superusers and returns the affected `ids` and their `count`.
     """
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
+    if not current_user.is_staff:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid Token"
+                            detail="You are not a superuser"
         )
-    
-    order_to_delete=db.query(Order).filter(Order.id==id).first()
 
-    db.delete(order_to_delete)
+    if bulk.order_status not in ORDER_STATUSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"order_status must be one of {', '.join(ORDER_STATUSES)}"
+        )
+
+    conditions=[]
+    if bulk.ids is not None:
+        conditions.append(Order.id.in_(bulk.ids))
+    if bulk.current_status is not None:
+        conditions.append(Order.order_status==bulk.current_status)
+    if bulk.pizza_size is not None:
+        conditions.append(Order.pizza_size==bulk.pizza_size)
+    if bulk.user_id is not None:
+        conditions.append(Order.user_id==bulk.user_id)
+    if not conditions:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide ids or at least one filter"
+        )
+
+    rows=await update_orders_status(db, bulk.order_status, conditions)
+    await record_order_changes(db, rows)
+    await db.commit()
+
+    ids=[row.id for row in rows]
+    await order_cache.invalidate(order_ids=ids, user_ids=[row.user_id for row in rows])
+    await order_events.publish_status([(row.id, row.user_id, bulk.order_status) for row in rows])
+
+    return {"ids":ids, "count":len(ids)}
+
+@order_router.delete('/order/delete/{id}', status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(jwt_required), Depends(query_budget(3))])
+async def delete_an_order(id:int, if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    """
+        ## Delete an Order
+        This deletes an order by its ID
+        With `If-Match: <ETag>` the order is only deleted if it is still at that version, else `412`.
+    """
+    expected_version=if_match_version(if_match, id)
+    order_to_delete=await delete_order(db, id, expected_version)
+    if order_to_delete is None:
+        raise await order_write_missed(db, id, expected_version)
 
-    db.commit()
+    await record_order_changes(db, [(id, order_to_delete.user_id, order_to_delete.version + 1)], deleted=True)
 
-    return order_to_delete
\ No newline at end of file
+    await db.commit()
+    await order_cache.invalidate(order_ids=[id], user_ids=[order_to_delete.user_id])
\ No newline at end of file
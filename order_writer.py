@@ -0,0 +1,130 @@
+"""
+    Group commit for single-order placement.
+
+    With ORDER_WRITE_BATCHING on, ``place_an_order`` hands its row to
+    ``order_writer`` instead of committing it itself. A background task
+    collects rows for up to ORDER_WRITE_MAX_DELAY_MS (or until
+    ORDER_WRITE_BATCH_SIZE are waiting), writes them with one multi-row INSERT
+    and one commit, and resolves each waiting request with its order id. Under
+    burst load this turns one commit (and fsync) per order into one per batch.
+"""
+import asyncio
+import logging
+import os
+from contextlib import suppress
+from crud import insert_orders, record_order_changes
+from database import env_bool, get_sessionmaker
+
+logger = logging.getLogger("pizza.order_writer")
+
+ORDER_WRITE_BATCHING = env_bool("ORDER_WRITE_BATCHING", False)
+ORDER_WRITE_BATCH_SIZE = int(os.getenv("ORDER_WRITE_BATCH_SIZE", "200"))
+ORDER_WRITE_MAX_DELAY_MS = float(os.getenv("ORDER_WRITE_MAX_DELAY_MS", "5"))
+# Backpressure: at most this many orders wait to be written, and a request
+# waits at most ORDER_WRITE_ENQUEUE_TIMEOUT seconds for room in the queue
+ORDER_WRITE_QUEUE_SIZE = int(os.getenv("ORDER_WRITE_QUEUE_SIZE", "2000"))
+ORDER_WRITE_ENQUEUE_TIMEOUT = float(os.getenv("ORDER_WRITE_ENQUEUE_TIMEOUT", "1"))
+
+
+class OrderWriterBusy(Exception):
+    """The write queue stayed full for longer than the enqueue timeout."""
+
+
+class OrderWriter:
+
+    def __init__(self, batch_size=200, max_delay=0.005, queue_size=2000, enqueue_timeout=1.0,
+                 sessionmaker=get_sessionmaker):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self.sessionmaker = sessionmaker
+        self.batches = 0
+        self.orders = 0
+        self._queue = None
+        self._full = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def queued(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        self._queue = asyncio.Queue(self.queue_size)
+        self._full = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Write every queued order, then stop. Called from the app lifespan on shutdown."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        self._full.set()
+        await self._task
+        self._task = None
+
+    async def submit(self, row):
+        """Queue an order row and wait until it is committed; returns its id."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._queue.put((row, future)), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise OrderWriterBusy()
+        if self._queue.qsize() >= self.batch_size:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.batch_size - 1:
+                # Give more orders a moment to arrive, unless a full batch is already waiting
+                self._full.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            stopping = None in batch
+            batch = [item for item in batch if item is not None]
+            if batch:
+                await self._flush(batch)
+            # Orders queued behind the stop marker still get written
+            stopping = stopping and self._queue.empty()
+
+    async def _flush(self, batch):
+        rows = [row for row, _ in batch]
+        try:
+            async with self.sessionmaker()() as db:
+                ids = await insert_orders(db, rows)
+                await record_order_changes(db, [(order_id, row["user_id"], 1) for order_id, row in zip(ids, rows)])
+                await db.commit()
+        except Exception as exc:
+            if len(batch) > 1:
+                # Retry one by one, so a bad row only fails its own request
+                logger.warning("Order batch of %d failed (%s), writing them one at a time", len(batch), exc)
+                for item in batch:
+                    await self._flush([item])
+                return
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(exc)
+            return
+
+        self.batches += 1
+        self.orders += len(batch)
+        for (_, future), order_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(order_id)
+
+
+order_writer = OrderWriter(
+    batch_size=ORDER_WRITE_BATCH_SIZE,
+    max_delay=ORDER_WRITE_MAX_DELAY_MS / 1000,
+    queue_size=ORDER_WRITE_QUEUE_SIZE,
+    enqueue_timeout=ORDER_WRITE_ENQUEUE_TIMEOUT,
+)
@@ -0,0 +1,110 @@
+import base64
+import json
+from typing import Optional
+from fastapi import Query, status
+from fastapi.exceptions import HTTPException
+from sqlalchemy import select, union_all
+from metrics import TimedJSONResponse
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class PageParams:
+    """Query parameters shared by every keyset-paginated list route."""
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+
+
+def encode_cursor(last_id, gaps=()):
+    """Opaque cursor for the last id read; the order changes feed also carries the id ``gaps`` it still re-checks."""
+    payload = {"id": last_id}
+    if gaps:
+        payload["gaps"] = [list(gap) for gap in gaps]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_payload(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        return int(payload["id"]), [(int(first), int(last), int(seen_at)) for first, last, seen_at in payload.get("gaps", ())]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid cursor"
+        )
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    return _decode_payload(cursor)[0]
+
+
+def decode_changes_cursor(cursor):
+    """``(last_id, gaps)`` of an order changes cursor; no cursor starts from the beginning."""
+    if not cursor:
+        return 0, []
+    return _decode_payload(cursor)
+
+
+async def paginate(db, stmt, id_column, page: PageParams):
+    """
+        Run ``stmt`` as one keyset page ordered by ``id_column``.
+        ``stmt`` should select columns (including ``id``) rather than entities;
+        the rows are returned as-is for the response model to read.
+        Returns the rows and the cursor of the next page (``None`` on the last page).
+    """
+    after = decode_cursor(page.cursor)
+    if after is not None:
+        stmt = stmt.filter(id_column > after)
+
+    # Fetch one extra row to learn whether another page exists
+    rows = (await db.execute(stmt.order_by(id_column).limit(page.limit + 1))).all()
+    return _page(rows, page)
+
+
+async def paginate_union(db, stmts, page: PageParams):
+    """
+        Like ``paginate``, over the UNION ALL of ``(stmt, id_column)`` pairs that
+        select the same columns, such as live and archived orders. Each part
+        is limited on its own index before the results are merged.
+    """
+    after = decode_cursor(page.cursor)
+    parts = []
+    for stmt, id_column in stmts:
+        if after is not None:
+            stmt = stmt.filter(id_column > after)
+        parts.append(select(stmt.order_by(id_column).limit(page.limit + 1).subquery()))
+    merged = union_all(*parts).subquery()
+    rows = (await db.execute(select(merged).order_by(merged.c.id).limit(page.limit + 1))).all()
+    return _page(rows, page)
+
+
+def _page(rows, page):
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        return rows, encode_cursor(rows[-1].id)
+    return rows, None
+
+
+def page_content(rows, next_cursor):
+    """The ``{"items", "next_cursor"}`` body of a page of column rows, as plain dicts."""
+    return {"items": [row._asdict() for row in rows], "next_cursor": next_cursor}
+
+
+def page_response(content, headers=None):
+    """
+        Render a page body directly. Large pages skip FastAPI's per-item response
+        model validation and ``jsonable_encoder`` pass, which cost far more than
+        rendering; the route's ``response_model`` still documents the shape, so
+        the selected columns must match it.
+    """
+    return TimedJSONResponse(content, headers=headers)
@@ -0,0 +1,139 @@
+"""
+    Query-count budgets and N+1 detection.
+
+    Routes declare how many SQL statements they may issue:
+
+        @order_router.get('/order', dependencies=[Depends(query_budget(1))])
+
+    Going over the budget is logged. With QUERY_BUDGET_STRICT=1 (development and
+    CI) the response is replaced with a 500, and every ORM query gets
+    ``raiseload('*')`` so relationships must be eager-loaded explicitly instead of
+    being lazy-loaded one row at a time.
+"""
+import json
+import logging
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.orm import Session, raiseload
+from database import env_bool
+from metrics import request_stats
+
+logger = logging.getLogger("pizza.query_budget")
+
+QUERY_BUDGET_STRICT = env_bool("QUERY_BUDGET_STRICT", False)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries):
+    """Dependency declaring the most SQL statements a route may issue."""
+    async def declare_budget():
+        stats = request_stats.get()
+        if stats is not None:
+            stats.query_budget = max_queries
+    return declare_budget
+
+
+def extend_query_budget(extra):
+    """Allow the current request ``extra`` more statements, for optional work such as idempotency records."""
+    stats = request_stats.get()
+    if stats is not None and stats.query_budget is not None:
+        stats.query_budget += extra
+
+
+class QueryBudgetMiddleware:
+    """
+        Checks the request's query count against its declared budget when the
+        response starts. Must run inside MetricsMiddleware, which counts the queries.
+    """
+
+    def __init__(self, app, strict=None):
+        self.app = app
+        self.strict = QUERY_BUDGET_STRICT if strict is None else strict
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        replaced = False
+
+        async def send_wrapper(message):
+            nonlocal replaced
+            if replaced:
+                return
+            stats = request_stats.get()
+            if (message["type"] == "http.response.start" and stats is not None
+                    and stats.query_budget is not None and stats.queries > stats.query_budget):
+                detail = (f"{scope['method']} {scope['path']} ran {stats.queries} queries, "
+                          f"over its budget of {stats.query_budget}")
+                logger.warning("Query budget exceeded: %s", detail)
+                if self.strict:
+                    replaced = True
+                    body = json.dumps({"detail": "Query budget exceeded: " + detail}).encode()
+                    await send({
+                        "type": "http.response.start",
+                        "status": 500,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())],
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def _raiseload_by_default(orm_execute_state):
+    if (orm_execute_state.is_select and not orm_execute_state.is_column_load
+            and not orm_execute_state.is_relationship_load):
+        orm_execute_state.statement = orm_execute_state.statement.options(raiseload("*"))
+
+
+def enable_raiseload():
+    """Make lazy relationship loads raise unless a query eager-loads them."""
+    if not event.contains(Session, "do_orm_execute", _raiseload_by_default):
+        event.listen(Session, "do_orm_execute", _raiseload_by_default)
+
+
+class QueryLog:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def assert_at_most(self, max_queries):
+        if self.count > max_queries:
+            raise QueryBudgetExceeded(
+                f"{self.count} queries, budget {max_queries}:\n" + "\n".join(self.statements)
+            )
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Record every SQL statement the engine runs inside the block."""
+    if engine is None:
+        from database import get_engine
+        engine = get_engine()
+    sync_engine = getattr(engine, "sync_engine", engine)
+    log = QueryLog()
+    event.listen(sync_engine, "before_cursor_execute", log._record)
+    try:
+        yield log
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", log._record)
+
+
+@contextmanager
+def assert_max_queries(max_queries, engine=None):
+    """Fail if the block runs more than ``max_queries`` SQL statements."""
+    with count_queries(engine) as log:
+        yield log
+    log.assert_at_most(max_queries)
@@ -0,0 +1,262 @@
+"""
+    Admission control: per-route rate limits and a global concurrency limit.
+
+    Expensive routes (password hashing in login/signup, large order scans)
+    declare a named limit:
+
+        @auth_router.post('/login', dependencies=[Depends(rate_limit("login"))])
+
+    Each limit is a token bucket per caller, keyed by the access token's subject
+    or, without a valid token, by the client IP. Over the limit the request gets
+    a 429 with ``Retry-After``. ConcurrencyLimitMiddleware caps the requests in
+    flight so bursts are shed with a 503 before they queue up on the DB pool.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import suppress
+from fastapi import Depends, Request, status
+from fastapi.exceptions import HTTPException
+from fastapi_jwt_auth import AuthJWT
+from database import DB_MAX_OVERFLOW, DB_POOL_SIZE
+
+logger = logging.getLogger("pizza.ratelimit")
+
+RateLimit = namedtuple("RateLimit", ["burst", "period"])
+
+# name=requests/seconds, overridable with RATE_LIMITS; a limit of 0 turns it off
+DEFAULT_RATE_LIMITS = "login=10/60,signup=5/60,refresh=30/60,place_order=60/60,bulk_orders=10/60,list_orders=60/60,export=5/60"
+
+# Requests handled at once, past which new ones wait up to MAX_CONCURRENT_WAIT
+# seconds and are then turned away; 0 turns the limit off
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+MAX_CONCURRENT_WAIT = float(os.getenv("MAX_CONCURRENT_WAIT", "0.5"))
+
+
+def parse_limits(spec):
+    """``"login=10/60,signup=5/60"`` -> ``{"login": RateLimit(10, 60.0), ...}``"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        burst, _, period = value.partition("/")
+        limits[name.strip()] = RateLimit(int(burst), float(period or 1))
+    return limits
+
+
+class MemoryBucketBackend:
+    """Token buckets in a bounded LRU dict: one lookup and one store per check."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+
+    async def take(self, key, rate, burst, cost=1):
+        """Take ``cost`` tokens; returns 0 when allowed, else the seconds until they are available."""
+        now = time.monotonic()
+        entry = self._buckets.get(key)
+        if entry is None:
+            tokens = burst
+        else:
+            tokens, updated = entry
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def size(self):
+        return len(self._buckets)
+
+
+class RedisBucketBackend:
+    """
+        Token buckets in Redis, shared by every worker. Each check is one
+        atomic script call.
+    """
+
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1])
+if tokens == nil then
+    tokens = burst
+else
+    tokens = math.min(burst, tokens + math.max(0, now - tonumber(state[2])) * rate)
+end
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, client, prefix="pizza:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, key, rate, burst, cost=1):
+        wait = await self.client.eval(self.SCRIPT, 1, self.prefix + key, rate, burst, time.time(), cost)
+        return float(wait)
+
+    def size(self):
+        return None
+
+    @classmethod
+    def from_url(cls, url):
+        import redis.asyncio as redis
+        return cls(redis.from_url(url))
+
+
+class RateLimiter:
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+        self.rejected = 0
+
+    async def check(self, name, identity, cost=1):
+        """Raise a 429 if ``identity`` is over the ``name`` limit. A failing shared backend lets requests through."""
+        limit = self.limits.get(name)
+        if self.backend is None or limit is None or limit.burst <= 0:
+            return
+        try:
+            wait = await self.backend.take(f"{name}:{identity}", limit.burst / limit.period, limit.burst, cost)
+        except Exception:
+            logger.exception("Rate limit check for %s failed, letting the request through", name)
+            return
+        if wait > 0:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+
+def client_identity(request: Request, Authorize: AuthJWT):
+    """The access token's subject, or the client IP for anonymous or invalid tokens."""
+    try:
+        subject = Authorize.get_jwt_subject()
+    except Exception:
+        subject = None
+    if subject is not None:
+        return f"user:{subject}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def rate_limit(name):
+    """Dependency applying the ``name`` limit from RATE_LIMITS to the caller."""
+    async def check_rate_limit(request: Request, Authorize: AuthJWT = Depends()):
+        await rate_limiter.check(name, client_identity(request, Authorize))
+    return check_rate_limit
+
+
+class ConcurrencyLimiter:
+    """
+        Caps the requests handled at once. A request over the cap waits up to
+        ``wait`` seconds for a slot; ``acquire`` returns False if none came free.
+    """
+
+    def __init__(self, limit, wait):
+        self.limit = limit
+        self.wait = wait
+        self.in_flight = 0
+        self.shed = 0
+        self._slots = asyncio.Semaphore(limit) if limit > 0 else None
+
+    @property
+    def enabled(self):
+        return self._slots is not None
+
+    async def acquire(self):
+        if not self._slots.locked():
+            await self._slots.acquire()
+        else:
+            acquire = asyncio.ensure_future(self._slots.acquire())
+            try:
+                await asyncio.wait_for(asyncio.shield(acquire), self.wait)
+            except asyncio.TimeoutError:
+                acquire.cancel()
+                with suppress(asyncio.CancelledError):
+                    await acquire
+                # Unless a slot freed up right as the wait ran out
+                if acquire.cancelled():
+                    self.shed += 1
+                    return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+
+class ConcurrencyLimitMiddleware:
+    """
+        Sheds requests over the concurrency limit with a 503 and ``Retry-After``.
+        Long-lived streams under the ``exempt`` path prefixes are not counted.
+    """
+
+    def __init__(self, app, limiter=None, exempt=()):
+        self.app = app
+        self.limiter = limiter or concurrency_limiter
+        self.exempt = tuple(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limiter.enabled or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.limiter.acquire():
+            await self._reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "The server is busy, try again shortly"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"1"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _make_backend(name):
+    if name == "memory":
+        return MemoryBucketBackend(maxsize=int(os.getenv("RATE_LIMIT_SIZE", "100000")))
+    if name == "redis":
+        return RedisBucketBackend.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return None
+
+
+rate_limiter = RateLimiter(
+    _make_backend(os.getenv("RATE_LIMIT_BACKEND", "memory")),
+    parse_limits(DEFAULT_RATE_LIMITS + "," + os.getenv("RATE_LIMITS", "")),
+)
+concurrency_limiter = ConcurrencyLimiter(MAX_CONCURRENT_REQUESTS, MAX_CONCURRENT_WAIT)
@@ -0,0 +1,185 @@
+"""
+    Token revocation behind ``/auth/logout`` and staff revoke-all.
+
+    fastapi_jwt_auth asks ``revocations.is_revoked`` about every token it
+    verifies, so the check has to stay in memory. Each worker keeps a denylist
+    of revoked token ids (``jti``) behind a Bloom filter, which answers most
+    checks (tokens that were never revoked) without touching the set, plus a
+    per-user cut-off for "revoke every token issued before now". Revocations are
+    written to ``token_revocations`` and every worker picks up new rows each
+    REVOCATION_SYNC_INTERVAL seconds. Entries are dropped once the tokens they
+    cover have expired.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, insert, or_, select
+from database import get_sessionmaker
+from models import TokenRevocation
+from schemas import Settings
+
+logger = logging.getLogger("pizza.revocation")
+
+# Seconds between syncs; a token revoked on another worker is accepted here for at most this long
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "2"))
+# Revoked tokens the Bloom filter is sized for before it is rebuilt larger
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", "100000"))
+# Rows this recent are read again on every sync, in case they committed out of id order
+SYNC_OVERLAP_SECONDS = 60
+SWEEP_INTERVAL_SECONDS = 300
+
+
+def max_token_lifetime():
+    """Seconds until every token issued now has expired, per the JWT settings."""
+    settings = Settings()
+    lifetimes = [settings.authjwt_access_token_expires, settings.authjwt_refresh_token_expires]
+    return max(int(v.total_seconds()) if isinstance(v, timedelta) else int(v) for v in lifetimes)
+
+
+def _epoch(value):
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _utc(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+class BloomFilter:
+    """Set membership without false negatives; false positives happen at about ``error_rate``."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * step) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class Denylist:
+    """Revoked token ids and per-subject cut-offs, each kept until the tokens it covers expire."""
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self._tokens = {}
+        self._subjects = {}
+        self._bloom = BloomFilter(capacity)
+
+    def is_revoked(self, token):
+        jti = token.get("jti")
+        if jti is not None and jti in self._bloom and jti in self._tokens:
+            return True
+        cutoff = self._subjects.get(token.get("sub"))
+        return cutoff is not None and token.get("iat", 0) <= cutoff[0]
+
+    def add(self, jti=None, subject=None, revoked_before=None, expires=0):
+        if jti is not None and jti not in self._tokens:
+            if len(self._tokens) >= self._bloom.capacity:
+                self.sweep(time.time())
+            self._tokens[jti] = expires
+            self._bloom.add(jti)
+        if subject is not None:
+            current = self._subjects.get(subject)
+            if current is None or revoked_before > current[0]:
+                self._subjects[subject] = (revoked_before, expires)
+
+    def sweep(self, now):
+        """Drop expired entries and rebuild the Bloom filter, which can't forget on its own."""
+        tokens = {jti: expires for jti, expires in self._tokens.items() if expires > now}
+        bloom = BloomFilter(max(self.capacity, 2 * len(tokens)))
+        for jti in tokens:
+            bloom.add(jti)
+        self._tokens, self._bloom = tokens, bloom
+        self._subjects = {subject: cutoff for subject, cutoff in self._subjects.items() if cutoff[1] > now}
+
+    def __len__(self):
+        return len(self._tokens) + len(self._subjects)
+
+
+class Revocations:
+
+    def __init__(self, denylist, sessionmaker=get_sessionmaker):
+        self.denylist = denylist
+        self.sessionmaker = sessionmaker
+        self._cursor = 0
+        self._swept_at = time.time()
+
+    def is_revoked(self, token):
+        return self.denylist.is_revoked(token)
+
+    async def revoke_tokens(self, db, tokens):
+        """Revoke decoded tokens (e.g. on logout) and commit."""
+        entries = [(token["jti"], token.get("exp") or int(time.time()) + max_token_lifetime()) for token in tokens]
+        await db.execute(insert(TokenRevocation), [{"jti": jti, "expires_at": _utc(expires)} for jti, expires in entries])
+        await db.commit()
+        for jti, expires in entries:
+            self.denylist.add(jti=jti, expires=expires)
+
+    async def revoke_subject(self, db, subject):
+        """Revoke every token issued to ``subject`` up to now and commit. Returns the cut-off (epoch seconds)."""
+        revoked_before = int(time.time())
+        expires = revoked_before + max_token_lifetime()
+        db.add(TokenRevocation(subject=subject, revoked_before=revoked_before, expires_at=_utc(expires)))
+        await db.commit()
+        self.denylist.add(subject=subject, revoked_before=revoked_before, expires=expires)
+        return revoked_before
+
+    async def sync(self):
+        """Load revocations committed since the last sync, by any worker."""
+        now = datetime.utcnow()
+        async with self.sessionmaker()() as db:
+            rows = (await db.execute(
+                select(TokenRevocation.id, TokenRevocation.jti, TokenRevocation.subject,
+                    TokenRevocation.revoked_before, TokenRevocation.expires_at)
+                .where(
+                    or_(TokenRevocation.id > self._cursor,
+                        TokenRevocation.created_at >= now - timedelta(seconds=SYNC_OVERLAP_SECONDS)),
+                    TokenRevocation.expires_at > now,
+                )
+                .order_by(TokenRevocation.id)
+            )).all()
+        for row in rows:
+            self.denylist.add(row.jti, row.subject, row.revoked_before, _epoch(row.expires_at))
+            self._cursor = max(self._cursor, row.id)
+
+        if time.time() - self._swept_at > SWEEP_INTERVAL_SECONDS:
+            self.denylist.sweep(time.time())
+            self._swept_at = time.time()
+
+    async def refresh(self):
+        try:
+            await self.sync()
+        except Exception:
+            logger.exception("Could not sync token revocations")
+
+    async def run_sync(self, interval=None):
+        """Background task for the app lifespan: sync every ``interval`` seconds until cancelled."""
+        interval = interval or REVOCATION_SYNC_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh()
+
+    async def purge(self):
+        """Delete rows whose tokens have all expired; run by ``python init_db.py purge-revocations``."""
+        async with self.sessionmaker()() as db:
+            result = await db.execute(delete(TokenRevocation).where(TokenRevocation.expires_at < datetime.utcnow()))
+            await db.commit()
+        return result.rowcount
+
+
+revocations = Revocations(Denylist(REVOCATION_BLOOM_CAPACITY))
@@ -1,5 +1,5 @@
-from typing import Optional
-from pydantic import BaseModel, EmailStr
+from typing import List, Optional
+from pydantic import BaseModel, EmailStr, conlist
 class UserSchema(BaseModel):
     id: int
     username: str
@@ -20,6 +20,19 @@ class User(UserBase):
 
     class Config:
         from_attributes = True  # For Pydantic v2.x (replaces orm_mode)
+        orm_mode = True  # For Pydantic v1.x
+
+class UserPage(BaseModel):
+    items: List[User]
+    next_cursor: Optional[str] = None
+
+class UserResponse(User):
+    is_staff: bool
+    is_active: bool
+
+    class Config:
+        from_attributes = True
+        orm_mode = True
 
 
 
@@ -47,11 +60,16 @@ class Settings(BaseModel):
     authjwt_algorithm: str = "HS256"             # Default algorithm for signing the JWT
     authjwt_access_token_expires: int = 3600       # Access token expiration time in minutes
     authjwt_refresh_token_expires: int = 30      # Refresh token expiration time in days
+    authjwt_denylist_enabled: bool = True        # Checked against revocation.py on every request
+    authjwt_denylist_token_checks: set = {"access", "refresh"}
 
 class LoginModel(BaseModel):
     username: str
     password: str
 
+class LogoutModel(BaseModel):
+    refresh: Optional[str] = None
+
 class OrderModel(BaseModel):
     quantity : str
     order_status : Optional[str]="PENDING" 
@@ -67,6 +85,74 @@ class OrderModel(BaseModel):
             }
         }  
 
+class BulkOrderModel(BaseModel):
+    orders : conlist(OrderModel, min_items=1, max_items=500) # type: ignore
+    allow_partial : bool = False
+
+    class Config:
+        schema_extra={
+            'example':{
+                "orders":[
+                    {"quantity":2,"pizza_size":"LARGE"},
+                    {"quantity":1,"pizza_size":"SMALL"}
+                ],
+                "allow_partial":False
+            }
+        }
+
+class BulkOrderStatusModel(BaseModel):
+    order_status : str
+    ids : Optional[conlist(int, min_items=1, max_items=1000)] # type: ignore
+    current_status : Optional[str]
+    pizza_size : Optional[str]
+    user_id : Optional[int]
+
+    class Config:
+        schema_extra={
+            'example':{
+                "order_status":"IN-TRANSIT",
+                "ids":[1,2,3]
+            }
+        }
+
+class OrderResponse(BaseModel):
+    id : int
+    quantity : int
+    order_status : str
+    pizza_size : str
+    user_id : Optional[int]
+    version : int
+
+    class Config:
+        from_attributes = True
+        orm_mode = True
+
+class OrderPage(BaseModel):
+    items : List[OrderResponse]
+    next_cursor : Optional[str] = None
+
+class OrderChangeResponse(BaseModel):
+    id : int
+    version : int
+    deleted : bool
+    quantity : Optional[int]
+    order_status : Optional[str]
+    pizza_size : Optional[str]
+    user_id : Optional[int]
+
+class OrderChangesPage(BaseModel):
+    items : List[OrderChangeResponse]
+    next_cursor : str
+    has_more : bool
+
+class BulkOrderResponse(BaseModel):
+    ids : List[int]
+    errors : List[dict] = []
+
+class BulkOrderStatusResponse(BaseModel):
+    ids : List[int]
+    count : int
+
 class OrderStatusModel(BaseModel):
     order_status:Optional[str]="PENDING"
 
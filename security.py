@@ -0,0 +1,141 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from fastapi import Depends, Security, status
+from fastapi.exceptions import HTTPException
+from fastapi.security import APIKeyHeader
+from fastapi_jwt_auth import AuthJWT
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from models import User
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """The identity of the caller, as carried in the access token."""
+    id: int
+    username: str
+    is_staff: bool
+
+
+class UserCache:
+    """Bounded LRU cache of user records keyed by username, with a TTL per entry."""
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._usernames = {}
+
+    def get(self, username):
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(username)
+            return None
+        self._entries.move_to_end(username)
+        return user
+
+    def set(self, user):
+        self.invalidate(user_id=user.id)
+        self._entries[user.username] = (user, time.monotonic() + self.ttl)
+        self._usernames[user.id] = user.username
+        while len(self._entries) > self.maxsize:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._usernames.pop(evicted.id, None)
+
+    def invalidate(self, user_id=None, username=None):
+        if user_id is not None and user_id in self._usernames:
+            self._remove(self._usernames[user_id])
+        if username is not None:
+            self._remove(username)
+
+    def clear(self):
+        self._entries.clear()
+        self._usernames.clear()
+
+    def _remove(self, username):
+        entry = self._entries.pop(username, None)
+        if entry is not None:
+            self._usernames.pop(entry[0].id, None)
+
+
+# Documents the Authorization header in the OpenAPI schema; AuthJWT reads the token itself
+bearer_scheme = APIKeyHeader(
+    name="Authorization",
+    scheme_name="Bearer Auth",
+    description="Enter: **'Bearer &lt;JWT&gt;'**, where JWT is the access token",
+    auto_error=False,
+)
+
+
+async def jwt_required(token: Optional[str] = Security(bearer_scheme), Authorize: AuthJWT = Depends()) -> AuthJWT:
+    """Require a valid access token. Routes that depend on this are marked as secured in the docs."""
+    try:
+        Authorize.jwt_required()
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Invalid Token"
+        )
+    return Authorize
+
+
+async def jwt_refresh_required(token: Optional[str] = Security(bearer_scheme), Authorize: AuthJWT = Depends()) -> AuthJWT:
+    """Require a valid refresh token."""
+    try:
+        Authorize.jwt_refresh_token_required()
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Please provide a valid refresh token"
+        )
+    return Authorize
+
+
+user_cache = UserCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+)
+
+
+def token_claims(user):
+    """Claims embedded in issued tokens so routes don't need to look the user up."""
+    return {"user_id": user.id, "is_staff": bool(user.is_staff)}
+
+
+async def load_user(db: AsyncSession, username) -> Optional[CurrentUser]:
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+
+    row = (await db.execute(
+        select(User.id, User.username, User.is_staff).filter(User.username == username)
+    )).first()
+    if row is None:
+        return None
+
+    user = CurrentUser(id=row.id, username=row.username, is_staff=bool(row.is_staff))
+    user_cache.set(user)
+    return user
+
+
+async def get_current_user(Authorize: AuthJWT = Depends(jwt_required), db: AsyncSession = Depends(get_db)) -> CurrentUser:
+    """
+        Require a valid access token and return the caller's identity.
+        The id and role come from the token claims; tokens issued before the
+        claims were added fall back to a cached lookup of the user.
+    """
+    claims = Authorize.get_raw_jwt() or {}
+    if "user_id" in claims and "is_staff" in claims:
+        return CurrentUser(id=claims["user_id"], username=claims["sub"], is_staff=claims["is_staff"])
+
+    user = await load_user(db, Authorize.get_jwt_subject())
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Invalid Token"
+        )
+    return user
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from archive import archive_orders
+from database import get_sessionmaker
+from models import Order
+
+
+def test_archived_orders_keep_their_fields_in_the_changes_feed(client, staff_headers, user_headers):
+    for size in ("SMALL", "LARGE"):
+        client.post("/order/order", json={"quantity": 2, "pizza_size": size}, headers=user_headers)
+    client.patch("/order/order/update/1", json={"order_status": "DELIVERED"}, headers=staff_headers)
+
+    async def archive():
+        async with get_sessionmaker()() as db:
+            await db.execute(update(Order).where(Order.id == 1).values(updated_at=datetime.utcnow() - timedelta(days=60)))
+            await db.commit()
+        return await archive_orders(older_than_days=30)
+
+    assert client.portal.call(archive) == 1
+    assert client.get("/order/order", headers=staff_headers).json()["items"][0]["id"] == 2
+
+    changes = client.get("/order/changes", headers=staff_headers).json()["items"]
+    assert changes[-1] == {
+        "id": 1, "quantity": 2, "order_status": "DELIVERED", "pizza_size": "SMALL", "user_id": 2, "version": 2, "deleted": False,
+    }
+    assert len(changes) == 2
+
+
+def test_orders_changed_recently_stay_live(client, staff_headers, user_headers):
+    client.post("/order/order", json={"quantity": 1, "pizza_size": "SMALL"}, headers=user_headers)
+    client.patch("/order/order/update/1", json={"order_status": "DELIVERED"}, headers=staff_headers)
+
+    assert client.portal.call(archive_orders, 30) == 0
+    assert client.get("/order/order", headers=staff_headers).json()["items"][0]["id"] == 1
@@ -0,0 +1,30 @@
+import asyncio
+from cache import OrderCache, RedisBackend
+
+
+def test_redis_entries_are_shared_by_workers(redis_workers):
+    async def check():
+        first_client, second_client = redis_workers(2)
+        first, second = RedisBackend(first_client), RedisBackend(second_client)
+        await first.set("order:1", {"id": 1, "version": 2}, ttl=30)
+        assert await second.get("order:1") == {"id": 1, "version": 2}
+        assert 0 < await first_client.ttl("pizza:order:1") <= 30
+
+        await second.delete("order:1", "user:1")
+        assert await first.get("order:1") is None
+
+    asyncio.run(check())
+
+
+class BrokenBackend:
+    async def delete(self, *keys):
+        raise ConnectionError("cache is down")
+
+
+def test_invalidation_failures_do_not_fail_the_write():
+    async def check():
+        cache = OrderCache(BrokenBackend(), reinvalidate_after=0.01)
+        await cache.invalidate(order_ids=[1], user_ids=[2])
+        await asyncio.gather(*cache._pending)
+
+    asyncio.run(check())
@@ -0,0 +1,74 @@
+from datetime import datetime
+from sqlalchemy import insert
+from database import get_sessionmaker
+from models import OrderChange
+
+ORDER = {"quantity": "2", "pizza_size": "LARGE"}
+
+
+def changes(client, headers, since=None):
+    params = {"since": since} if since else {}
+    response = client.get("/order/changes", params=params, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_the_cursor_only_returns_newer_changes(client, staff_headers, user_headers):
+    client.post("/order/order", json=ORDER, headers=user_headers)
+    first = changes(client, staff_headers)
+    assert [item["id"] for item in first["items"]] == [1]
+
+    assert changes(client, staff_headers, first["next_cursor"])["items"] == []
+    client.post("/order/order", json=ORDER, headers=user_headers)
+    second = changes(client, staff_headers, first["next_cursor"])
+    assert [item["id"] for item in second["items"]] == [2]
+    assert changes(client, staff_headers, second["next_cursor"])["items"] == []
+
+
+def test_an_order_changed_several_times_is_returned_once(client, staff_headers, user_headers):
+    client.post("/order/order", json=ORDER, headers=user_headers)
+    client.post("/order/order", json=ORDER, headers=user_headers)
+    for order_status in ("IN-TRANSIT", "DELIVERED"):
+        client.patch("/order/order/update/1", json={"order_status": order_status}, headers=staff_headers)
+
+    items = changes(client, staff_headers)["items"]
+    assert [(item["id"], item["version"]) for item in items] == [(2, 1), (1, 3)]
+    assert items[1]["order_status"] == "DELIVERED"
+
+
+def test_deleted_orders_come_back_as_tombstones(client, staff_headers, user_headers):
+    client.post("/order/order", json=ORDER, headers=user_headers)
+    cursor = changes(client, staff_headers)["next_cursor"]
+    client.delete("/order/order/delete/1", headers=user_headers)
+    assert changes(client, staff_headers, cursor)["items"] == [{"id": 1, "version": 2, "deleted": True}]
+
+
+def test_pages_follow_has_more(client, staff_headers, user_headers):
+    for _ in range(3):
+        client.post("/order/order", json=ORDER, headers=user_headers)
+    page = client.get("/order/changes", params={"limit": 2}, headers=staff_headers).json()
+    assert [item["id"] for item in page["items"]] == [1, 2] and page["has_more"]
+    page = client.get("/order/changes", params={"limit": 2, "since": page["next_cursor"]}, headers=staff_headers).json()
+    assert [item["id"] for item in page["items"]] == [3] and not page["has_more"]
+
+
+def test_a_change_committed_after_a_later_one_is_not_skipped(client, staff_headers, user_headers):
+    client.post("/order/order", json=ORDER, headers=user_headers)
+    client.post("/order/order", json=ORDER, headers=user_headers)
+
+    async def log(change_id, order_id):
+        async with get_sessionmaker()() as db:
+            await db.execute(insert(OrderChange).values(
+                id=change_id, order_id=order_id, user_id=1, version=1, deleted=False, changed_at=datetime.utcnow(),
+            ))
+            await db.commit()
+
+    # Change 4 commits while change 3 is still in flight
+    client.portal.call(log, 4, 2)
+    first = changes(client, staff_headers)
+    assert [item["id"] for item in first["items"]] == [1, 2]
+
+    client.portal.call(log, 3, 1)
+    second = changes(client, staff_headers, first["next_cursor"])
+    assert [item["id"] for item in second["items"]] == [1]
+    assert changes(client, staff_headers, second["next_cursor"])["items"] == []
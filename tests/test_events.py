@@ -0,0 +1,24 @@
+import asyncio
+from events import RedisBroker
+
+
+def test_redis_events_reach_subscribers_on_other_workers(redis_workers):
+    async def check():
+        publisher, subscriber = (RedisBroker(client) for client in redis_workers(2))
+        async with subscriber.subscribe("user_orders:1") as subscription:
+            # Wait for the listener's pattern subscription before publishing
+            for _ in range(100):
+                if (await publisher.client.pubsub_numpat()) > 0:
+                    break
+                await asyncio.sleep(0.01)
+            await publisher.publish("user_orders:1", {"id": 1, "order_status": "IN-TRANSIT"})
+            await publisher.publish_many([
+                ("user_orders:2", {"id": 2, "order_status": "DELIVERED"}),
+                ("user_orders:1", {"id": 3, "order_status": "DELIVERED"}),
+            ])
+            received = [await asyncio.wait_for(subscription.get(), 1) for _ in range(2)]
+            assert subscriber.subscriber_count() == 1
+        await subscriber.close()
+        assert received == [{"id": 1, "order_status": "IN-TRANSIT"}, {"id": 3, "order_status": "DELIVERED"}]
+
+    asyncio.run(check())
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import httpx
+import pytest
+from sqlalchemy import func, select
+from database import get_sessionmaker
+from idempotency import idempotency, request_fingerprint
+from models import IdempotencyKey, Order
+from schemas import OrderModel
+
+ORDER = {"quantity": "2", "pizza_size": "LARGE"}
+
+
+def count_orders(client):
+    async def count():
+        async with get_sessionmaker()() as db:
+            return (await db.execute(select(func.count(Order.id)))).scalar()
+    return client.portal.call(count)
+
+
+def place(client, headers, key, body=ORDER):
+    return client.post("/order/order", json=body, headers={**headers, "Idempotency-Key": key})
+
+
+def test_a_repeated_key_replays_the_first_response(client, user_headers):
+    first = place(client, user_headers, "order-1")
+    assert first.status_code == 201
+    second = place(client, user_headers, "order-1")
+    assert second.status_code == 201
+    assert second.json() == first.json()
+    assert count_orders(client) == 1
+
+
+def test_a_key_reused_for_another_body_is_rejected(client, user_headers):
+    place(client, user_headers, "order-1")
+    response = place(client, user_headers, "order-1", {"quantity": "3", "pizza_size": "LARGE"})
+    assert response.status_code == 422
+    assert count_orders(client) == 1
+
+
+def test_concurrent_duplicates_on_one_worker_place_one_order(client, user_headers):
+    async def place_concurrently():
+        async with httpx.AsyncClient(app=client.app, base_url="http://testserver") as http:
+            return await asyncio.gather(*(
+                http.post("/order/order", json=ORDER, headers={**user_headers, "Idempotency-Key": "order-1"})
+                for _ in range(5)
+            ))
+
+    responses = client.portal.call(place_concurrently)
+    assert [response.status_code for response in responses] == [201] * 5
+    assert len({json.dumps(response.json(), sort_keys=True) for response in responses}) == 1
+    assert count_orders(client) == 1
+
+
+def test_losing_a_cross_worker_race_returns_the_winners_response(client, user_headers, monkeypatch):
+    # Another worker commits the same key after this request looked it up
+    winner = {"id": 99, "quantity": 2, "pizza_size": "LARGE", "order_status": "PENDING", "version": 1}
+
+    async def commit_winner(user_id):
+        async with get_sessionmaker()() as db:
+            db.add(IdempotencyKey(
+                user_id=user_id, idempotency_key="order-1", response=json.dumps({**winner, "user_id": user_id}),
+                fingerprint=request_fingerprint("POST /order/order", OrderModel(**ORDER).dict()),
+            ))
+            await db.commit()
+
+    lookup = idempotency.lookup
+    lookups = []
+
+    async def lookup_before_the_winner_commits(db, user_id, key):
+        lookups.append(key)
+        if len(lookups) == 1:
+            winner["user_id"] = user_id
+            await commit_winner(user_id)
+            return None
+        return await lookup(db, user_id, key)
+
+    monkeypatch.setattr(idempotency, "lookup", lookup_before_the_winner_commits)
+    response = place(client, user_headers, "order-1")
+    assert response.status_code == 201
+    assert response.json() == winner
+    assert count_orders(client) == 0
+
+
+class BrokenBackend:
+    async def get(self, key):
+        raise ConnectionError("cache is down")
+
+    async def set(self, key, value, ttl):
+        raise ConnectionError("cache is down")
+
+
+def test_a_failing_cache_backend_falls_back_to_the_database(client, user_headers, monkeypatch):
+    monkeypatch.setattr(idempotency, "backend", BrokenBackend())
+    first = place(client, user_headers, "order-1")
+    assert first.status_code == 201
+    second = place(client, user_headers, "order-1")
+    assert second.json() == first.json()
+    assert count_orders(client) == 1
+
+
+@pytest.fixture(autouse=True)
+def forget_cached_keys():
+    """The memory backend outlives each test's database."""
+    yield
+    if idempotency.backend is not None and hasattr(idempotency.backend, "_entries"):
+        idempotency.backend._entries.clear()
@@ -0,0 +1,36 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from metrics import MetricsMiddleware, metrics
+
+
+def test_rows_written_counts_writes_only(client, staff_headers, user_headers):
+    before = dict(metrics.rows_written)
+    client.post("/order/order", json={"quantity": "1", "pizza_size": "SMALL"}, headers=user_headers)
+    client.get("/order/order", headers=staff_headers)
+
+    def written(key):
+        return metrics.rows_written.get(key, 0) - before.get(key, 0)
+    # The order and its change log entry
+    assert written(("POST", "/order/order")) == 2
+    assert written(("GET", "/order/order")) == 0
+
+
+def test_exempt_streams_are_not_recorded():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, exempt=("/test-metrics/stream",))
+
+    @app.get("/test-metrics/stream")
+    async def stream():
+        assert metrics.in_flight == 0
+        return {}
+
+    @app.get("/test-metrics/plain")
+    async def plain():
+        assert metrics.in_flight == 1
+        return {}
+
+    with TestClient(app) as client:
+        assert client.get("/test-metrics/stream").status_code == 200
+        assert client.get("/test-metrics/plain").status_code == 200
+    assert ("GET", "/test-metrics/stream") not in metrics.latency
+    assert ("GET", "/test-metrics/plain") in metrics.latency
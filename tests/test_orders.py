@@ -0,0 +1,26 @@
+import pytest
+
+
+@pytest.mark.parametrize("body, detail", [
+    ({"quantity": "abc", "pizza_size": "LARGE"}, "quantity must be an integer"),
+    ({"quantity": "0", "pizza_size": "LARGE"}, "quantity must be at least 1"),
+    ({"quantity": "2", "pizza_size": "HUGE"}, "pizza_size must be one of"),
+])
+def test_invalid_orders_are_rejected_before_they_are_written(client, staff_headers, user_headers, body, detail):
+    response = client.post("/order/order", json=body, headers=user_headers)
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith(detail)
+    assert client.get("/order/order", headers=staff_headers).json()["items"] == []
+
+    client.post("/order/order", json={"quantity": "2", "pizza_size": "LARGE"}, headers=user_headers)
+    response = client.put("/order/order/update/1/", json=body, headers=user_headers)
+    assert response.status_code == 400
+    assert client.get("/order/orders/1", headers=staff_headers).json()["quantity"] == 2
+
+
+def test_quantities_are_stored_as_integers(client, user_headers):
+    response = client.post("/order/order", json={"quantity": "2", "pizza_size": "LARGE"}, headers=user_headers)
+    assert response.status_code == 201
+    assert response.json()["quantity"] == 2
+    response = client.put("/order/order/update/1/", json={"quantity": 3, "pizza_size": "SMALL"}, headers=user_headers)
+    assert response.json()["quantity"] == 3
@@ -0,0 +1,70 @@
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select, text
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import selectinload
+from database import get_sessionmaker
+from metrics import MetricsMiddleware, instrument_engine
+from models import User
+from query_budget import QueryBudgetExceeded, QueryBudgetMiddleware, enable_raiseload, query_budget
+
+
+def test_order_routes_stay_within_their_budgets(client, staff_headers, user_headers, max_queries):
+    for _ in range(3):
+        assert client.post("/order/order", json={"quantity": 1, "pizza_size": "LARGE"}, headers=user_headers).status_code == 201
+
+    with max_queries(1):
+        response = client.get("/order/order", headers=staff_headers)
+    assert response.status_code == 200
+    assert len(response.json()["items"]) == 3
+
+    with max_queries(2):
+        response = client.patch("/order/order/update/1", json={"order_status": "IN-TRANSIT"}, headers=staff_headers)
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+
+
+def test_max_queries_fails_over_budget(client, staff_headers, max_queries):
+    with pytest.raises(QueryBudgetExceeded):
+        with max_queries(0):
+            client.get("/order/order", headers=staff_headers)
+
+
+@pytest.mark.parametrize("strict, status_code", [(True, 500), (False, 200)])
+def test_middleware_replaces_over_budget_responses_when_strict(strict, status_code):
+    app = FastAPI()
+    app.add_middleware(QueryBudgetMiddleware, strict=strict)
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/two-queries", dependencies=[Depends(query_budget(1))])
+    async def two_queries():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        instrument_engine(engine)
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await conn.execute(text("SELECT 2"))
+        await engine.dispose()
+        return {"ok": True}
+
+    response = TestClient(app).get("/two-queries")
+    assert response.status_code == status_code
+    if strict:
+        assert response.json()["detail"] == "Query budget exceeded: GET /two-queries ran 2 queries, over its budget of 1"
+
+
+def test_raiseload_rejects_lazy_relationship_loads(client, user_headers):
+    enable_raiseload()
+
+    async def load_orders():
+        async with get_sessionmaker()() as db:
+            user = (await db.execute(select(User).filter(User.username == "customer"))).scalar_one()
+            with pytest.raises(InvalidRequestError, match="lazy='raise'"):
+                user.orders
+            user = (await db.execute(
+                select(User).options(selectinload(User.orders)).filter(User.username == "customer")
+            )).scalar_one()
+            return user.orders
+
+    assert client.portal.call(load_orders) == []
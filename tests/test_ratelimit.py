@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from fastapi.exceptions import HTTPException
+from ratelimit import RateLimit, RateLimiter, RedisBucketBackend
+
+
+def test_redis_buckets_are_shared_by_workers(redis_workers):
+    pytest.importorskip("lupa")  # fakeredis needs it to run the Lua script
+
+    async def check():
+        first, second = (RedisBucketBackend(client) for client in redis_workers(2))
+        assert await first.take("login:ip:1", rate=0.1, burst=2) == 0
+        assert await second.take("login:ip:1", rate=0.1, burst=2) == 0
+        assert await first.take("login:ip:1", rate=0.1, burst=2) == pytest.approx(10, abs=0.1)
+        assert await second.take("login:ip:2", rate=0.1, burst=2) == 0
+
+        limiter = RateLimiter(second, {"login": RateLimit(2, 20)})
+        with pytest.raises(HTTPException) as rejected:
+            await limiter.check("login", "ip:1")
+        assert rejected.value.status_code == 429
+        assert rejected.value.headers["Retry-After"] == "10"
+
+    asyncio.run(check())
@@ -0,0 +1,66 @@
+import time
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+import database
+from database import PRIMARY_UNTIL_COOKIE, PRIMARY_UNTIL_HEADER, StickyPrimaryMiddleware, get_db, get_read_db
+from models import Base, Order
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A client for a small app on two SQLite files, a primary and a replica that never catches up."""
+    monkeypatch.setattr(database, "DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setattr(database, "DATABASE_REPLICA_URL", f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+
+    app = FastAPI()
+    app.add_middleware(StickyPrimaryMiddleware)
+
+    @app.post("/orders")
+    async def place_order(db=Depends(get_db)):
+        db.add(Order(quantity=1, pizza_size="SMALL"))
+        await db.commit()
+
+    @app.get("/orders/count")
+    async def count_orders(db=Depends(get_read_db)):
+        return (await db.execute(select(func.count(Order.id)))).scalar()
+
+    async def create_tables():
+        for engine in (database.get_engine(), database.get_replica_engine()):
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+
+    with TestClient(app) as client:
+        client.portal.call(create_tables)
+        yield client
+        client.portal.call(database.dispose_engine)
+
+
+def test_reads_go_to_the_replica(client):
+    response = client.get("/orders/count")
+    assert response.json() == 0
+    assert PRIMARY_UNTIL_COOKIE not in response.cookies
+    assert PRIMARY_UNTIL_HEADER not in response.headers
+
+
+def test_a_write_keeps_the_client_on_the_primary(client):
+    written = client.post("/orders")
+    assert PRIMARY_UNTIL_COOKIE in written.cookies
+    until = float(written.headers[PRIMARY_UNTIL_HEADER])
+    assert time.time() < until <= time.time() + database.DB_STICKY_PRIMARY_SECONDS
+
+    # The cookie comes back with the next request, whichever worker serves it
+    assert client.get("/orders/count").json() == 1
+
+    # Other clients read the replica, unless they echo the header back
+    client.cookies.clear()
+    assert client.get("/orders/count").json() == 0
+    assert client.get("/orders/count", headers={PRIMARY_UNTIL_HEADER: written.headers[PRIMARY_UNTIL_HEADER]}).json() == 1
+
+
+@pytest.mark.parametrize("until", [lambda: time.time() - 1, lambda: time.time() + 3600, lambda: "soon"])
+def test_expired_or_forged_windows_read_the_replica(client, until):
+    client.post("/orders")
+    client.cookies.clear()
+    assert client.get("/orders/count", headers={PRIMARY_UNTIL_HEADER: str(until())}).json() == 0
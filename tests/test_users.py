@@ -0,0 +1,7 @@
+def test_a_deleted_users_tokens_stop_working(client, user_headers):
+    client.post("/order/order", json={"quantity": "1", "pizza_size": "SMALL"}, headers=user_headers)
+    assert client.get("/order/user/orders", headers=user_headers).status_code == 200
+
+    assert client.delete("/users/1").status_code == 200
+    assert client.get("/order/user/orders", headers=user_headers).status_code == 401
+    assert client.post("/order/order", json={"quantity": "1", "pizza_size": "SMALL"}, headers=user_headers).status_code == 401